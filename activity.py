@@ -0,0 +1,150 @@
+# ------------------- Imports -------------------
+from array import array
+import base64
+import sys
+import time
+
+
+# ------------------- Constants -------------------
+BUCKET_SECONDS = 3600  # One bucket per hour
+BUCKET_COUNT = 30 * 24  # 30 days of hourly buckets
+
+# Clan record field -> window length in buckets
+WINDOWS = {
+    "lastdaymessages": 24,
+    "lastweekmessages": 7 * 24,
+    "last2weeksmessages": 14 * 24,
+    "lastmonthsmessages": 30 * 24,
+}
+_WINDOW_LENGTHS = tuple(WINDOWS.values())
+
+
+DISCORD_EPOCH = 1420070400  # 2015-01-01, in seconds
+
+
+def current_hour(now=None):
+    return int((time.time() if now is None else now) // BUCKET_SECONDS)
+
+
+def snowflake_time(snowflake):
+    """Creation time (unix seconds) encoded in a Discord snowflake id."""
+    return ((int(snowflake) >> 22) / 1000) + DISCORD_EPOCH
+
+
+# ------------------- Activity Counter -------------------
+
+
+class ActivityCounter:
+    """Hourly message counts for the last 30 days, held in a ring buffer.
+
+    Running totals for every window in WINDOWS are kept alongside the ring, so
+    reading a window is O(1) and moving the clock forward costs one step per
+    elapsed hour (at most BUCKET_COUNT steps).
+    """
+
+    __slots__ = ("buckets", "head_hour", "totals", "version", "seeded")
+
+    def __init__(self, buckets=None, head_hour=None, seeded=False):
+        self.buckets = array('I', bytes(4 * BUCKET_COUNT))
+        self.head_hour = head_hour
+        self.totals = [0] * len(_WINDOW_LENGTHS)
+        self.version = 0
+        # True once the ring has been filled from channel history
+        self.seeded = seeded
+        if isinstance(buckets, array) and len(buckets) == BUCKET_COUNT:
+            self.buckets = buckets
+            self._recount()
+        elif buckets:
+            for i, count in enumerate(buckets[:BUCKET_COUNT]):
+                self.buckets[i] = max(0, int(count))
+            self._recount()
+
+    def _recount(self):
+        if self.head_hour is None:
+            return
+        for w, length in enumerate(_WINDOW_LENGTHS):
+            self.totals[w] = sum(
+                self.buckets[(self.head_hour - age) % BUCKET_COUNT] for age in range(length))
+
+    def advance(self, hour):
+        if self.head_hour is None:
+            self.head_hour = hour
+            return
+        steps = hour - self.head_hour
+        if steps <= 0:
+            return
+        self.version += 1
+        if steps >= BUCKET_COUNT:
+            self.buckets = array('I', bytes(4 * BUCKET_COUNT))
+            self.totals = [0] * len(_WINDOW_LENGTHS)
+            self.head_hour = hour
+            return
+        buckets = self.buckets
+        totals = self.totals
+        for h in range(self.head_hour + 1, hour + 1):
+            # Bucket h - length just left the window of that length. For the
+            # 30 day window that is the slot being reused for hour h.
+            for w, length in enumerate(_WINDOW_LENGTHS):
+                totals[w] -= buckets[(h - length) % BUCKET_COUNT]
+            buckets[h % BUCKET_COUNT] = 0
+        self.head_hour = hour
+
+    def record(self, timestamp=None, delta=1):
+        """Add `delta` messages at `timestamp` (defaults to now)."""
+        now_hour = current_hour()
+        self.advance(now_hour)
+        hour = now_hour if timestamp is None else min(current_hour(timestamp), now_hour)
+        age = now_hour - hour
+        if age >= BUCKET_COUNT:
+            return
+        index = hour % BUCKET_COUNT
+        if delta < 0:
+            delta = -min(-delta, self.buckets[index])
+            if not delta:
+                return
+        self.buckets[index] += delta
+        for w, length in enumerate(_WINDOW_LENGTHS):
+            if age < length:
+                self.totals[w] += delta
+        self.version += 1
+
+    def merge(self, other):
+        """Add every count in `other` to this ring."""
+        hour = current_hour()
+        self.advance(hour)
+        other.advance(hour)
+        for i, count in enumerate(other.buckets):
+            if count:
+                self.buckets[i] += count
+        self._recount()
+        self.version += 1
+
+    def to_dict(self):
+        """Serialize with the ring packed as base64 little-endian uint32s."""
+        return {"head_hour": self.head_hour, "seeded": self.seeded,
+                "buckets": _pack(self.buckets)}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Load to_dict() output; "buckets" may also be a plain list of counts."""
+        if not isinstance(data, dict):
+            return cls()
+        buckets = data.get("buckets")
+        if isinstance(buckets, str):
+            buckets = _unpack(buckets)
+        return cls(buckets, data.get("head_hour"), data.get("seeded", False))
+
+
+def _pack(buckets):
+    if sys.byteorder == "big":
+        buckets = array('I', buckets)
+        buckets.byteswap()
+    return base64.b64encode(buckets.tobytes()).decode("ascii")
+
+
+def _unpack(text):
+    buckets = array('I')
+    buckets.frombytes(base64.b64decode(text))
+    if sys.byteorder == "big":
+        buckets.byteswap()
+    return buckets
@@ -0,0 +1,351 @@
+"""Drive concurrent interactions through main.py against the local stand-ins.
+
+The handlers run for real, with the real coc.py client and DiscordHTTPClient
+talking HTTP to benchmarks/standins.py (started in-process unless
+--discord-url and --coc-url point at running ones). Interaction responses,
+followups and channel messages are sent to the Discord stand-in through
+main.discord_http, the way the library would send them.
+
+    python benchmarks/loadtest.py --concurrency 50 --interactions 2000
+    python benchmarks/loadtest.py --mix player_lookup=1 --coc-latency lognormal:300,0.8 --coc-error-rate 0.05
+
+Interaction kinds (--mix weights):
+    player_lookup   /player_lookup for a user with 1-3 linked accounts
+    select_clan     /clan select
+    create_emoji    create_custom_emoji_via_api with a fresh name
+    ticket_flow     a whole application: start, account menu, 2 x (tag, skip)
+
+--background-clans N queues N background-priority clan fetches up front,
+to check interactive lookups stay fast while a large job drains.
+
+Reports throughput and per-kind p50/p90/p99/p99.9 end-to-end latency.
+"""
+# ------------------- Imports -------------------
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+import aiohttp
+
+import standins
+from replay import FakeMessage, FakeUser, unwrap
+from scheduler import BACKGROUND
+
+KINDS = ("player_lookup", "select_clan", "create_emoji", "ticket_flow")
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+TAG_CHARACTERS = "0289PYLQGRJCUV"
+
+
+# ------------------- Discord Objects Over HTTP -------------------
+
+
+def to_payload(value):
+    if isinstance(value, (list, tuple)):
+        return [to_payload(item) for item in value]
+    return value.to_dict() if hasattr(value, "to_dict") else value
+
+
+def message_payload(content=None, embed=None, embeds=None, components=None, **_):
+    payload = {"content": content or ""}
+    embeds = ([embed] if embed is not None else []) + list(embeds or [])
+    if embeds:
+        payload["embeds"] = to_payload(embeds)
+    if components:
+        payload["components"] = to_payload(components if isinstance(components, list) else [components])
+    return payload
+
+
+class RestChannel:
+    def __init__(self, http, channel_id, guild_id, name="general"):
+        self.http = http
+        self.id = channel_id
+        self.guild_id = guild_id
+        self.name = name
+
+    async def send(self, content=None, **kwargs):
+        body = await self.http.request("POST", f"/channels/{self.id}/messages",
+                                       json=message_payload(content, **kwargs))
+        return SimpleNamespace(id=int(body["id"]))
+
+
+class RestContext:
+    """An interaction: the first reply is the callback, later ones are followups."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, http, channel, author, custom_id=None, values=()):
+        self.http = http
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild_id = channel.guild_id
+        self.author = author
+        self.custom_id = custom_id
+        self.values = list(values)
+        self.interaction_id = next(self.ids)
+        self.token = f"token{self.interaction_id}"
+        self.responded = False
+
+    async def _callback(self, kind, data):
+        self.responded = True
+        await self.http.request("POST", f"/interactions/{self.interaction_id}/{self.token}/callback",
+                                json={"type": kind, "data": data})
+
+    async def defer(self, ephemeral=False):
+        await self._callback(5, {"flags": 64 if ephemeral else 0})
+
+    async def send(self, content=None, ephemeral=False, **kwargs):
+        payload = message_payload(content, **kwargs)
+        if ephemeral:
+            payload["flags"] = 64
+        if not self.responded:
+            return await self._callback(4, payload)
+        await self.http.request("POST", f"/webhooks/1/{self.token}", json=payload)
+
+    async def edit_origin(self, **kwargs):
+        await self._callback(7, message_payload(**kwargs))
+
+
+# ------------------- Load Driver -------------------
+
+
+class LoadTest:
+    def __init__(self, args, settings):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.workdir = tempfile.mkdtemp(prefix="bot-loadtest-")
+        os.environ.update(settings)
+        os.environ["DATABASE_PATH"] = os.path.join(self.workdir, "loadtest.db")
+        os.environ["METRICS_PORT"] = "0"
+        # Failures handled inside the handlers are counted in the report instead
+        os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+        os.environ.setdefault("BOT_TOKEN", "loadtest")
+        os.chdir(self.workdir)
+        import main
+        self.main = main
+        listeners = getattr(main.bot, "listeners", {}).get("component") or [main.on_component]
+        self.component_listeners = [unwrap(listener) for listener in listeners]
+        self.asset_base = settings["COC_API_BASE"].rsplit("/", 1)[0]
+        self.latencies = {kind: [] for kind in KINDS}
+        self.errors = {kind: Counter() for kind in KINDS}
+        self.background = []
+        self.background_errors = Counter()
+        self.emoji_names = itertools.count(1)
+        self.channel_ids = itertools.count(1_000_000)
+
+    def random_tag(self):
+        return "#" + "".join(self.rng.choice(TAG_CHARACTERS) for _ in range(8))
+
+    async def setup(self):
+        main, args = self.main, self.args
+        main.coc_client = await main.connect_coc_client()
+        await main.discord_http.start()
+        self.guild_ids = [100 + i for i in range(args.guilds)]
+        self.clan_tags = [self.random_tag() for _ in range(args.clans)]
+        player_tags = [self.random_tag() for _ in range(args.players)]
+        self.users = [FakeUser(1_000 + i) for i in range(args.users)]
+        for user in self.users:
+            for tag in self.rng.sample(player_tags, self.rng.randint(1, 3)):
+                main.player_links.add(str(user.id), tag)
+
+    async def close(self):
+        main = self.main
+        if main.coc_client is not None:
+            await main.coc_client.close()
+        await main.clan_data_writer.flush()
+        await main.storage.drain()
+        await main.discord_http.close()
+        main.storage.close()
+
+    def channel(self, name="general"):
+        return RestChannel(self.main.discord_http, next(self.channel_ids), self.rng.choice(self.guild_ids), name)
+
+    def context(self, channel=None, author=None, custom_id=None, values=()):
+        return RestContext(self.main.discord_http, channel or self.channel(),
+                           author or self.rng.choice(self.users), custom_id, values)
+
+    # Interactions
+
+    async def player_lookup(self):
+        await unwrap(self.main.player_lookup)(self.context(), self.rng.choice(self.users), "no")
+
+    async def select_clan(self):
+        await unwrap(self.main.select_clan)(self.context(), self.rng.choice(self.clan_tags))
+
+    async def create_emoji(self):
+        name = f"loadtest_{next(self.emoji_names)}"
+        await self.main.create_custom_emoji_via_api(
+            self.rng.choice(self.guild_ids), name, f"{self.asset_base}/assets/badges/medium/{name}.png")
+
+    async def ticket_flow(self):
+        main = self.main
+        applicant = self.rng.choice(self.users)
+        channel = self.channel(f"ticket|{applicant.username}")
+        # What /ticket open does once the channel exists
+        message = await channel.send(content=f"<@{applicant.id}>", embed=main.create_ticket_embed(applicant.id))
+        main.ticket_store.save(channel.id, main.new_ticket(channel.guild_id, applicant.id, message.id))
+
+        event = SimpleNamespace(ctx=self.context(channel, applicant, "start_application"))
+        for listener in self.component_listeners:
+            await listener(event)
+        await unwrap(main.menu_callback)(self.context(channel, applicant, "account_selection", values=["2"]))
+        on_message_create = unwrap(main.on_message_create)
+        for content in (self.random_tag(), "skip", self.random_tag(), "skip"):
+            message = FakeMessage(next(self.channel_ids), channel, applicant, content)
+            await on_message_create(SimpleNamespace(message=message))
+        main.ticket_store.delete(channel.id)
+
+    async def worker(self, kinds, weights, remaining):
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            kind = self.rng.choices(kinds, weights)[0]
+            started = time.perf_counter()
+            try:
+                await getattr(self, kind)()
+            except Exception as e:
+                self.errors[kind][type(e).__name__] += 1
+            self.latencies[kind].append(time.perf_counter() - started)
+
+    async def background_clan(self, tag):
+        started = time.perf_counter()
+        try:
+            await self.main.get_clan(tag, BACKGROUND)
+        except Exception as e:
+            self.background_errors[type(e).__name__] += 1
+        self.background.append(time.perf_counter() - started)
+
+    async def run(self):
+        kinds, weights = zip(*self.args.mix.items())
+        remaining = [self.args.interactions]
+        background = asyncio.gather(*(self.background_clan(self.random_tag())
+                                      for _ in range(self.args.background_clans)))
+        started = time.perf_counter()
+        await asyncio.gather(*(self.worker(kinds, weights, remaining) for _ in range(self.args.concurrency)))
+        seconds = time.perf_counter() - started
+        await background
+        return seconds
+
+
+# ------------------- Reporting -------------------
+
+
+def latency_stats(latencies):
+    latencies = sorted(latencies)
+    stats = {"count": len(latencies)}
+    for q in QUANTILES:
+        stats[f"p{q * 100:g}_ms"] = latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    stats["max_ms"] = latencies[-1] * 1000
+    return stats
+
+
+async def fetch_stats(base_url):
+    parts = urlsplit(base_url)
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{parts.scheme}://{parts.netloc}/_stats") as response:
+            return await response.json()
+
+
+def print_report(results):
+    print(f"{results['completed']} interactions in {results['seconds']:.2f}s with concurrency "
+          f"{results['concurrency']}: {results['throughput']:.1f}/s")
+    columns = ["count"] + [f"p{q * 100:g}_ms" for q in QUANTILES] + ["max_ms"]
+    print(f"\n{'kind':<16}" + "".join(f"{column:>12}" for column in columns) + f"{'errors':>10}")
+    for kind, stats in results["kinds"].items():
+        print(f"{kind:<16}{stats['count']:>12}" + "".join(f"{stats[column]:>12.1f}" for column in columns[1:])
+              + f"{sum(stats['errors'].values()):>10}")
+    for kind, stats in results["kinds"].items():
+        for error, count in stats["errors"].items():
+            print(f"  {kind}: {count} x {error}")
+    print(f"\n{'bot outbound call':<40}{'count':>8}{'errors':>8}{'p50_ms':>10}{'p99_ms':>10}")
+    for name, stats in results["outbound"].items():
+        print(f"{name:<40}{stats['count']:>8}{stats['errors']:>8}{stats['p50_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    for service, stats in results["standins"].items():
+        print(f"\n{service} stand-in:")
+        for name, value in sorted(stats.items()):
+            print(f"  {name:<60}{value:>10}")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown interaction kind {kind!r}, expected one of {', '.join(KINDS)}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=20, help="Interactions in flight at once")
+    parser.add_argument("--interactions", type=int, default=1000, help="Total interactions to run")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("player_lookup=4,select_clan=3,create_emoji=1,ticket_flow=2"))
+    parser.add_argument("--background-clans", type=int, default=0, help="Background clan fetches queued up front")
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--clans", type=int, default=50, help="Distinct clan tags for /clan select")
+    parser.add_argument("--players", type=int, default=2000, help="Distinct linked player tags")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--discord-url", help="DISCORD_API_BASE of running stand-ins")
+    parser.add_argument("--coc-url", help="COC_API_BASE of running stand-ins")
+    parser.add_argument("--coc-tokens", default="standin-1,standin-2,standin-3,standin-4,standin-5")
+    parser.add_argument("--json", help="Also write the results to this file")
+    standins.add_arguments(parser)
+    args = parser.parse_args(argv)
+    args.json = args.json and os.path.abspath(args.json)
+    return args
+
+
+async def run(args):
+    runners = []
+    if args.discord_url and args.coc_url:
+        settings = {"DISCORD_API_BASE": args.discord_url, "COC_API_BASE": args.coc_url,
+                    "COC_API_TOKENS": args.coc_tokens}
+    else:
+        _, _, runners, settings = await standins.start_standins(args)
+    load_test = LoadTest(args, settings)
+    try:
+        await load_test.setup()
+        seconds = await load_test.run()
+        standin_stats = {"discord": await fetch_stats(settings["DISCORD_API_BASE"]),
+                         "coc": await fetch_stats(settings["COC_API_BASE"])}
+    finally:
+        await load_test.close()
+        for runner in runners:
+            await runner.cleanup()
+
+    completed = sum(len(latencies) for latencies in load_test.latencies.values())
+    kinds = {}
+    for kind, latencies in load_test.latencies.items():
+        if latencies:
+            kinds[kind] = dict(latency_stats(latencies), errors=dict(load_test.errors[kind]))
+    everything = [latency for latencies in load_test.latencies.values() for latency in latencies]
+    kinds["all"] = dict(latency_stats(everything),
+                        errors=dict(sum(load_test.errors.values(), Counter())))
+    if load_test.background:
+        kinds["background_clan"] = dict(latency_stats(load_test.background), errors=dict(load_test.background_errors))
+    outbound = {f"{kind} {name}": {"count": count, "errors": errors, "p50_ms": p50 * 1000, "p99_ms": p99 * 1000}
+                for kind, name, count, errors, p50, p99 in load_test.main.metrics.summary(limit=None)
+                if kind in ("coc", "discord_rest")}
+    return {"completed": completed, "seconds": seconds, "concurrency": args.concurrency,
+            "throughput": completed / seconds if seconds else 0.0, "kinds": kinds, "outbound": outbound,
+            "standins": standin_stats}
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,605 @@
+"""Replay gateway events through the real handlers in main.py.
+
+Discord and the CoC API are replaced by in-memory fakes, so a run measures
+only our own code: the listeners, component callbacks, commands and the clan
+refresh cycle, including the write-behind saves to a throwaway database.
+
+    python benchmarks/replay.py                      # compare against benchmarks/baseline.json
+    python benchmarks/replay.py --save-baseline      # record a new baseline
+    python benchmarks/replay.py --clans 500 --events 50000 --scenario message_burst
+
+Every scenario is replayed from the same seeded state --repeat + 2 times:
+one warm-up pass for the caches, --repeat timed passes (the best one
+counts) and one pass under tracemalloc for allocations.
+Results are compared against the baseline and the exit status is 1 if events
+per second, a handler's p95 latency or its retained memory per event got
+worse by more than --tolerance, and 2 if the baseline is missing (unless
+--allow-missing-baseline) or was recorded with other settings. Baselines are
+only comparable on the same machine with the same settings, so none is
+committed: record one on the machine that runs the comparison.
+"""
+# ------------------- Imports -------------------
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from activity import DISCORD_EPOCH  # noqa: E402
+from clans import ClanRecord  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+# Ignore differences smaller than these, they are noise at this scale
+MIN_LATENCY_DELTA_US = 5.0
+MIN_RETAINED_DELTA_BYTES = 64
+MIN_LATENCY_SAMPLES = 50  # Fewer calls than this make p95 too noisy to compare
+
+
+# ------------------- Fakes -------------------
+
+
+def make_snowflake(timestamp, sequence):
+    return (int((timestamp - DISCORD_EPOCH) * 1000) << 22) | (sequence & 0x3FFFFF)
+
+
+class FakeUser:
+    def __init__(self, user_id, bot=False):
+        self.id = user_id
+        self.bot = bot
+        self.name = self.username = self.display_name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+        self.avatar_url = f"https://cdn.discordapp.com/avatars/{user_id}/avatar.png"
+
+
+class FakeMessage:
+    def __init__(self, message_id, channel, author, content="", created_at=None):
+        self.id = message_id
+        self.channel = channel
+        self._channel_id = channel.id
+        self._guild_id = channel.guild_id
+        self.author = author
+        self.content = content
+        self.attachments = []
+        self.created_at = created_at or datetime.datetime.now(datetime.timezone.utc)
+
+
+class FakeChannel:
+    """A text channel whose history is a list of FakeMessage sorted by id."""
+
+    def __init__(self, channel_id, guild_id, name="general"):
+        self.id = channel_id
+        self.guild_id = guild_id
+        self.name = name
+        self.history = []
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        return FakeMessage(self.id * 1000 + self.sent, self, FakeUser(0, bot=True), content or "")
+
+    async def fetch_messages(self, limit=50, before=None, after=None):
+        if after is not None:
+            page = [message for message in self.history if message.id > int(after)][:limit]
+            return list(reversed(page))
+        page = [message for message in self.history if before is None or message.id < int(before)]
+        return list(reversed(page[-limit:]))
+
+    async def edit(self, **kwargs):
+        self.name = kwargs.get("name", self.name)
+
+    async def delete(self):
+        pass
+
+    async def set_permissions(self, *args, **kwargs):
+        pass
+
+
+class FakeBot:
+    """Stands in for the interactions Client: only channel lookups are needed."""
+
+    def __init__(self):
+        self.channels = {}
+        self.user = FakeUser(0, bot=True)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(int(channel_id))
+
+
+class FakeContext:
+    def __init__(self, channel, author, custom_id=None, values=()):
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild_id = channel.guild_id
+        self.author = author
+        self.custom_id = custom_id
+        self.values = list(values)
+
+    async def defer(self, ephemeral=False):
+        pass
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def edit_origin(self, **kwargs):
+        pass
+
+
+class FakeCocClient:
+    """Deterministic players and clans, optionally with a fixed API latency."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def _wait(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def get_clan(self, tag):
+        await self._wait()
+        badge = SimpleNamespace(medium=f"https://api-assets.clashofclans.com/badges/{tag[1:]}.png")
+        members = [SimpleNamespace(name=f"member{i}", tag=f"#P{tag[1:5]}{i:04d}") for i in range(30)]
+        return SimpleNamespace(
+            tag=tag, name=f"Clan {tag}", badge=badge, level=10, description="Benchmark clan",
+            member_count=len(members), members=members, points=40000, war_wins=120,
+            war_win_streak=3, type="inviteOnly", required_trophies=2000)
+
+    async def get_player(self, tag):
+        await self._wait()
+        league = SimpleNamespace(name="Legend League", icon=SimpleNamespace(url="https://api-assets.clashofclans.com/leagues/legend.png"))
+        clan = SimpleNamespace(name="BenchClan", tag="#2PP", badge=SimpleNamespace(medium="https://api-assets.clashofclans.com/badges/2PP.png"))
+        return SimpleNamespace(
+            name=f"player{tag}", tag=tag, exp_level=200, league=league, trophies=5200, clan=clan,
+            role="member", war_stars=1500, donations=300, attack_wins=80, defense_wins=5,
+            town_hall=15)
+
+
+class FakeDiscordHTTP:
+    """Answers the raw REST calls made for guild emojis and badge images."""
+
+    def __init__(self):
+        self.emoji_ids = 0
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def request(self, method, path, json=None):
+        if method == "GET":
+            return []
+        self.emoji_ids += 1
+        return {"id": str(self.emoji_ids), "name": json["name"]}
+
+    async def fetch_bytes(self, url):
+        return b"\x89PNG\r\n\x1a\n" + url.encode()
+
+
+# ------------------- Environment -------------------
+
+
+def unwrap(handler):
+    """The coroutine behind an interactions Listener/command object."""
+    return getattr(handler, "callback", handler)
+
+
+class BenchEnv:
+    """Imports main.py against a throwaway database and swaps in the fakes."""
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix="bot-bench-")
+        os.environ["DATABASE_PATH"] = os.path.join(self.workdir, "bench.db")
+        os.environ["METRICS_PORT"] = "0"
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        os.environ.setdefault("BOT_TOKEN", "benchmark")
+        # storage.migrate_json_files() reads legacy JSON from the working directory
+        os.chdir(self.workdir)
+        import main
+        self.main = main
+
+        # The Component listeners are registered on the client, not bound to names
+        listeners = getattr(main.bot, "listeners", {}).get("component") or [main.on_component]
+        self.component_listeners = [unwrap(listener) for listener in listeners]
+
+        self.bot = FakeBot()
+        main.bot = self.bot
+        main.coc_client = FakeCocClient(latency=args.coc_latency / 1000)
+        main.discord_http = FakeDiscordHTTP()
+
+    def seed(self):
+        """Reset clans, channels, tickets and links to the same starting state."""
+        main, args = self.main, self.args
+        rng = random.Random(args.seed)
+        self.rng = rng
+        now = time.time()
+        self.guild_id = 100
+        self.bot.channels.clear()
+        main.clan_data.clear()
+        main.live_since_message.clear()
+        main.ticket_store.tickets.clear()
+
+        self.clan_channels = []
+        for i in range(args.clans):
+            channel = FakeChannel(10_000 + i, self.guild_id, name=f"clan-{i}")
+            self.bot.channels[channel.id] = channel
+            self.clan_channels.append(channel)
+            tag = f"#C{i:06d}"
+            main.clan_data[tag] = ClanRecord(
+                name=f"Clan {i}", default_channel=channel.id, clan_role=20_000 + i,
+                leader_role=30_000 + i, requirement="TH12")
+            # History for the first (full) backfill of the refresh scenario
+            for n in range(args.history):
+                created = now - rng.uniform(0, 29 * 86400)
+                channel.history.append(FakeMessage(
+                    make_snowflake(created, n), channel, FakeUser(rng.randrange(1, 5000)),
+                    created_at=datetime.datetime.fromtimestamp(created, datetime.timezone.utc)))
+            channel.history.sort(key=lambda message: message.id)
+        self.other_channels = []
+        for i in range(max(0, args.channels - args.clans)):
+            channel = FakeChannel(50_000 + i, self.guild_id, name=f"chat-{i}")
+            self.bot.channels[channel.id] = channel
+            self.other_channels.append(channel)
+
+        main.rebuild_clan_channel_index()
+        main.activity_leaderboard.rebuild(main.clan_data)
+        self.users = [FakeUser(1_000 + i) for i in range(args.users)]
+        for user in self.users[:64]:
+            for n in range(2):
+                main.player_links.add(str(user.id), f"#P{user.id}{n}")
+        self.sequence = 0
+
+    def message(self, channel, author, content="hello"):
+        self.sequence += 1
+        return FakeMessage(make_snowflake(time.time(), self.sequence), channel, author, content)
+
+    async def settle(self):
+        """Let queued saves reach the database, as the bot would between events."""
+        await self.main.clan_data_writer.flush()
+        await self.main.storage.drain()
+
+    def close(self):
+        self.main.storage.close()
+
+
+# ------------------- Scenarios -------------------
+# Each scenario returns [(handler name, coroutine function, argument), ...]
+
+
+def message_burst(env):
+    main, rng = env.main, env.rng
+    handler = unwrap(main.on_message_create)
+    events = []
+    for _ in range(env.args.events):
+        if env.other_channels and rng.random() < env.args.foreign_share:
+            channel = rng.choice(env.other_channels)
+        else:
+            channel = rng.choice(env.clan_channels)
+        message = env.message(channel, rng.choice(env.users))
+        events.append(("on_message_create", handler, SimpleNamespace(message=message)))
+    return events
+
+
+def delete_burst(env):
+    main, rng = env.main, env.rng
+    handler = unwrap(main.on_message_delete)
+    events = []
+    for _ in range(env.args.events // 4):
+        channel = rng.choice(env.clan_channels)
+        message = rng.choice(channel.history) if channel.history else env.message(channel, env.users[0])
+        events.append(("on_message_delete", handler, SimpleNamespace(message=message)))
+    return events
+
+
+def dispatch_component(env):
+    async def on_component(event):
+        for listener in env.component_listeners:
+            await listener(event)
+    return on_component
+
+
+def ticket_flow(env):
+    """Start Application -> account count -> tag/screenshot per account."""
+    main, rng = env.main, env.rng
+    on_component = dispatch_component(env)
+    menu_callback = unwrap(main.menu_callback)
+    on_message_create = unwrap(main.on_message_create)
+    events = []
+    for i in range(env.args.tickets):
+        channel = FakeChannel(90_000 + i, env.guild_id, name=f"ticket|applicant{i}")
+        env.bot.channels[channel.id] = channel
+        applicant = rng.choice(env.users)
+        main.ticket_store.tickets[channel.id] = main.new_ticket(env.guild_id, applicant.id, 1)
+        events.append(("on_component", on_component,
+                       SimpleNamespace(ctx=FakeContext(channel, applicant, "start_application"))))
+        events.append(("menu_callback", menu_callback,
+                       FakeContext(channel, applicant, "account_selection", values=["2"])))
+        for n in range(2):
+            tag = "#" + "".join(rng.choice("0289PYLQGRJCUV") for _ in range(8))
+            for content in (tag, "skip"):
+                events.append(("on_message_create", on_message_create,
+                               SimpleNamespace(message=env.message(channel, applicant, content))))
+    return events
+
+
+def component_clicks(env):
+    main, rng = env.main, env.rng
+    on_component = dispatch_component(env)
+    leaderboard_page = unwrap(main.leaderboard_page_callback)
+    pages = main.activity_leaderboard.page_count(main.LEADERBOARD_PAGE_SIZE)
+    events = []
+    for _ in range(env.args.events // 10):
+        channel = rng.choice(env.clan_channels)
+        user = rng.choice(env.users)
+        if rng.random() < 0.8:
+            custom_id = f"leaderboard_{rng.choice(('prev', 'next'))}:{rng.randrange(pages)}"
+            events.append(("leaderboard_page_callback", leaderboard_page, FakeContext(channel, user, custom_id)))
+        else:
+            events.append(("on_component", on_component,
+                           SimpleNamespace(ctx=FakeContext(channel, user, "human_support"))))
+    return events
+
+
+def member_join(env):
+    main, rng = env.main, env.rng
+    handler = unwrap(main.on_member_join)
+    system_channel = env.clan_channels[0]
+    events = []
+    for i in range(env.args.events // 10):
+        member = FakeUser(500_000 + i)
+        member.guild = SimpleNamespace(id=env.guild_id, system_channel=system_channel)
+        events.append(("on_member_join", handler, member))
+    return events
+
+
+def commands(env):
+    main, rng = env.main, env.rng
+    linked = env.users[:64]
+    handlers = {
+        "select_clan": unwrap(main.select_clan),
+        "clan_activity": unwrap(main.clan_activity),
+        "clan_leaderboard": unwrap(main.clan_leaderboard),
+        "player_lookup": unwrap(main.player_lookup),
+    }
+    tags = list(main.clan_data)
+    events = []
+    for _ in range(env.args.events // 20):
+        ctx = FakeContext(rng.choice(env.clan_channels), rng.choice(env.users))
+        name = rng.choice(tuple(handlers))
+        if name == "player_lookup":
+            args = (ctx, rng.choice(linked), "no")
+        elif name == "clan_leaderboard":
+            args = (ctx,)
+        else:
+            args = (ctx, rng.choice(tags))
+        events.append((name, handlers[name], args))
+    return events
+
+
+def refresh(env):
+    """Full 30 day backfill on the first cycle, checkpointed fetches after."""
+    main, rng = env.main, env.rng
+
+    async def refresh_all_clans(missed):
+        for channel, messages in missed:
+            channel.history.extend(messages)
+        await main.refresh_all_clans()
+
+    events = []
+    for cycle in range(env.args.refresh_cycles):
+        # Messages posted while the bot "wasn't listening", none before the first cycle
+        missed = [(channel, [env.message(channel, rng.choice(env.users)) for _ in range(env.args.missed)])
+                  for channel in env.clan_channels] if cycle else []
+        events.append(("refresh_all_clans", refresh_all_clans, missed))
+    return events
+
+
+SCENARIOS = {
+    "message_burst": message_burst,
+    "delete_burst": delete_burst,
+    "ticket_flow": ticket_flow,
+    "component_clicks": component_clicks,
+    "member_join": member_join,
+    "commands": commands,
+    "refresh": refresh,
+}
+
+
+# ------------------- Runner -------------------
+
+
+def percentile(samples, q):
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+async def call(handler, argument):
+    if isinstance(argument, tuple):
+        return await handler(*argument)
+    return await handler(argument)
+
+
+async def replay(env, names, trace_allocations=False):
+    """Replay every scenario once; returns (scenario stats, per-handler samples)."""
+    scenarios = {}
+    samples = {}  # handler -> {"latency": [...], "peak": [...], "retained": [...]}
+    for name in names:
+        env.seed()
+        events = SCENARIOS[name](env)
+        if trace_allocations:
+            tracemalloc.start()
+        started = time.perf_counter()
+        for handler_name, handler, argument in events:
+            if trace_allocations:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            event_started = time.perf_counter()
+            await call(handler, argument)
+            elapsed = time.perf_counter() - event_started
+            handler_samples = samples.setdefault(handler_name, {"latency": [], "peak": [], "retained": []})
+            handler_samples["latency"].append(elapsed)
+            if trace_allocations:
+                current, peak = tracemalloc.get_traced_memory()
+                handler_samples["peak"].append(peak - before)
+                handler_samples["retained"].append(current - before)
+            # Give write-behind flushes and other background tasks a turn
+            await asyncio.sleep(0)
+        await env.settle()
+        duration = time.perf_counter() - started
+        if trace_allocations:
+            tracemalloc.stop()
+        scenarios[name] = {"events": len(events), "seconds": duration,
+                           "events_per_second": len(events) / duration if duration else 0.0}
+    return scenarios, samples
+
+
+async def run(args):
+    env = BenchEnv(args)
+    try:
+        await replay(env, args.scenario)  # Warm the caches and lazily built state
+        # Keep the best of --repeat timed passes, slower ones are mostly scheduler noise
+        passes = [await replay(env, args.scenario) for _ in range(args.repeat)]
+        _, allocations = await replay(env, args.scenario, trace_allocations=True)
+    finally:
+        env.close()
+
+    scenarios = {name: max((scenarios[name] for scenarios, _ in passes),
+                           key=lambda stats: stats["events_per_second"])
+                 for name in passes[0][0]}
+    handlers = {}
+    for name in sorted(passes[0][1]):
+        runs = [sorted(timings[name]["latency"]) for _, timings in passes]
+        traced = allocations.get(name, {"peak": [0], "retained": [0]})
+        handlers[name] = {
+            "count": len(runs[0]),
+            "p50_us": min(percentile(latency, 0.50) for latency in runs) * 1e6,
+            "p95_us": min(percentile(latency, 0.95) for latency in runs) * 1e6,
+            "p99_us": min(percentile(latency, 0.99) for latency in runs) * 1e6,
+            "max_us": min(latency[-1] for latency in runs) * 1e6,
+            "peak_alloc_bytes": max(traced["peak"]),
+            "retained_bytes_per_event": sum(traced["retained"]) / len(traced["retained"]),
+        }
+    return {"config": config_of(args), "scenarios": scenarios, "handlers": handlers}
+
+
+def config_of(args):
+    return {key: getattr(args, key) for key in (
+        "clans", "channels", "users", "events", "tickets", "history", "missed",
+        "refresh_cycles", "foreign_share", "coc_latency", "seed", "scenario")}
+
+
+# ------------------- Reporting -------------------
+
+
+def print_report(results):
+    print(f"{'scenario':<20}{'events':>10}{'seconds':>10}{'events/s':>14}")
+    for name, stats in results["scenarios"].items():
+        print(f"{name:<20}{stats['events']:>10}{stats['seconds']:>10.3f}{stats['events_per_second']:>14.0f}")
+    print()
+    print(f"{'handler':<28}{'count':>8}{'p50 us':>10}{'p95 us':>10}{'p99 us':>10}"
+          f"{'max us':>12}{'peak KiB':>10}{'kept B/ev':>11}")
+    for name, stats in results["handlers"].items():
+        print(f"{name:<28}{stats['count']:>8}{stats['p50_us']:>10.1f}{stats['p95_us']:>10.1f}"
+              f"{stats['p99_us']:>10.1f}{stats['max_us']:>12.1f}{stats['peak_alloc_bytes'] / 1024:>10.1f}"
+              f"{stats['retained_bytes_per_event']:>11.1f}")
+
+
+def compare(results, baseline, tolerance):
+    """Return a line per regression against `baseline`."""
+    regressions = []
+    for name, stats in results["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old and stats["events_per_second"] < old["events_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {stats['events_per_second']:.0f} events/s, "
+                               f"baseline {old['events_per_second']:.0f}")
+    for name, stats in results["handlers"].items():
+        old = baseline["handlers"].get(name)
+        if not old:
+            continue
+        if (stats["count"] >= MIN_LATENCY_SAMPLES
+                and stats["p95_us"] > old["p95_us"] * (1 + tolerance)
+                and stats["p95_us"] - old["p95_us"] > MIN_LATENCY_DELTA_US):
+            regressions.append(f"{name}: p95 {stats['p95_us']:.1f} us, baseline {old['p95_us']:.1f} us")
+        retained, old_retained = stats["retained_bytes_per_event"], old["retained_bytes_per_event"]
+        if (retained > old_retained * (1 + tolerance)
+                and retained - old_retained > MIN_RETAINED_DELTA_BYTES):
+            regressions.append(f"{name}: keeps {retained:.0f} B/event, baseline {old_retained:.0f} B/event")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable, default: all)")
+    parser.add_argument("--clans", type=int, default=200)
+    parser.add_argument("--channels", type=int, default=400, help="Clan channels plus plain chat channels")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=20000, help="Message creates; other scenarios scale from this")
+    parser.add_argument("--tickets", type=int, default=200)
+    parser.add_argument("--history", type=int, default=200, help="Messages per clan channel for the first backfill")
+    parser.add_argument("--missed", type=int, default=20, help="Messages per clan channel between refresh cycles")
+    parser.add_argument("--refresh-cycles", type=int, default=3)
+    parser.add_argument("--foreign-share", type=float, default=0.2, help="Share of messages outside clan channels")
+    parser.add_argument("--coc-latency", type=float, default=0.0, help="Fake CoC API latency in ms")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes, the best one is reported")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--allow-missing-baseline", action="store_true",
+                        help="Exit 0 instead of 2 when there is no baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before failing")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+    args.scenario = args.scenario or list(SCENARIOS)
+    # main.py is imported from a scratch directory, see BenchEnv
+    args.baseline = os.path.abspath(args.baseline)
+    args.json = args.json and os.path.abspath(args.json)
+    return args
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"\nNo baseline at {args.baseline}; record one with --save-baseline", file=sys.stderr)
+        return 0 if args.allow_missing_baseline else 2
+    if baseline["config"] != results["config"]:
+        print(f"\nBaseline {args.baseline} was recorded with different settings, not comparing", file=sys.stderr)
+        return 2
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\nREGRESSION ({len(regressions)}) against {args.baseline}, tolerance {args.tolerance:.0%}:",
+              file=sys.stderr)
+        for line in regressions:
+            print(f"  {line}", file=sys.stderr)
+        return 1
+    print(f"\nNo regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,458 @@
+"""Local stand-ins for the Discord REST API and the Clash of Clans API.
+
+They answer the endpoints the bot uses with plausible bodies after a
+configurable latency, enforce rate limits the way the real services do
+(X-RateLimit-* headers and 429s for Discord, per-token throttling for CoC)
+and can inject random 429s and 5xx failures. CoC 502/504s are what coc.py
+turns into GatewayError once its own retries run out; --coc-failing-tags
+makes a share of tags fail every time so that path is reached.
+
+    python benchmarks/standins.py --discord-latency lognormal:40,0.5 --coc-latency lognormal:150,0.6
+
+then start the bot (or benchmarks/loadtest.py --discord-url/--coc-url) with
+the printed DISCORD_API_BASE, COC_API_BASE and COC_API_TOKENS.
+
+Latencies are "fixed:MS", "uniform:MIN_MS,MAX_MS", "exp:MEAN_MS" or
+"lognormal:MEDIAN_MS,SIGMA". GET /_stats on either server returns counters.
+"""
+# ------------------- Imports -------------------
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+import time
+import zlib
+from collections import Counter, deque
+from aiohttp import web
+
+
+DISCORD_PREFIX = "/api/v10"
+COC_PREFIX = "/v1"
+DISCORD_EPOCH_MS = 1420070400000
+
+# 1x1 transparent PNG served for every badge and league icon
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000100e221bc330000000049454e44ae426082")
+
+
+# ------------------- Latency -------------------
+
+
+class Latency:
+    """A latency distribution parsed from a spec such as "lognormal:40,0.5"."""
+
+    def __init__(self, spec, rng=None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, _, params = spec.partition(":")
+        values = [float(value) for value in params.split(",") if value]
+        expected = {"fixed": 1, "uniform": 2, "exp": 1, "lognormal": 2}
+        if kind not in expected or len(values) != expected[kind]:
+            raise ValueError(f"Bad latency spec {spec!r}, expected e.g. fixed:20, uniform:5,50, "
+                             f"exp:20 or lognormal:40,0.5")
+        self.kind = kind
+        self.values = values
+
+    def sample(self):
+        """One latency in seconds."""
+        if self.kind == "fixed":
+            ms = self.values[0]
+        elif self.kind == "uniform":
+            ms = self.rng.uniform(*self.values)
+        elif self.kind == "exp":
+            ms = self.rng.expovariate(1 / self.values[0]) if self.values[0] else 0.0
+        else:
+            median, sigma = self.values
+            ms = self.rng.lognormvariate(math.log(median), sigma) if median else 0.0
+        return ms / 1000
+
+
+class StandIn:
+    """Shared latency, failure injection and counters for one fake service."""
+
+    def __init__(self, latency, rate_limit_rate=0.0, error_rate=0.0, seed=None):
+        self.rng = random.Random(seed)
+        self.latency = Latency(latency, self.rng)
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.stats = Counter()
+
+    def route_name(self, request):
+        resource = request.match_info.route.resource
+        return f"{request.method} {resource.canonical if resource else request.path}"
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        if request.path == "/_stats":
+            return await handler(request)
+        route = self.route_name(request)
+        self.stats["requests"] += 1
+        self.stats[f"requests {route}"] += 1
+        await asyncio.sleep(self.latency.sample())
+        response = await self.check(request, route)
+        if response is None:
+            response = await handler(request)
+        self.stats[f"status {response.status}"] += 1
+        return response
+
+    async def check(self, request, route):
+        """Return an error response to send instead of calling the handler, if any."""
+        return None
+
+    async def stats_handler(self, request):
+        return web.json_response(dict(self.stats))
+
+    def application(self, prefix, routes):
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get("/_stats", self.stats_handler)
+        for method, path, handler in routes:
+            app.router.add_route(method, prefix + path, handler)
+        return app
+
+
+# ------------------- Discord -------------------
+
+
+class DiscordStandIn(StandIn):
+    """The Discord v10 emoji, channel message and interaction response endpoints.
+
+    Each route and major parameter (guild or channel id) gets a bucket of
+    `bucket_limit` requests per `bucket_window` seconds, reported in the
+    X-RateLimit-* headers; going over it is a 429 with retry_after.
+    """
+
+    def __init__(self, latency="fixed:0", bucket_limit=50, bucket_window=1.0, rate_limit_rate=0.0,
+                 global_share=0.1, error_rate=0.0, emoji_limit=0, seed=None):
+        super().__init__(latency, rate_limit_rate, error_rate, seed)
+        self.bucket_limit = bucket_limit
+        self.bucket_window = bucket_window
+        self.global_share = global_share
+        self.emoji_limit = emoji_limit
+        self.buckets = {}  # (route, major parameter) -> (window reset at, requests left)
+        self.emojis = {}  # guild id -> [emoji]
+        self.messages = {}  # channel id -> [message]
+        self._sequence = 0
+
+    def snowflake(self):
+        self._sequence += 1
+        return str(((int(time.time() * 1000) - DISCORD_EPOCH_MS) << 22) | (self._sequence & 0x3FFFFF))
+
+    def rate_limited(self, retry_after, is_global=False, bucket=None):
+        self.stats["injected 429" if bucket is None else "bucket 429"] += 1
+        headers = {"Retry-After": str(math.ceil(retry_after)), "X-RateLimit-Scope": "global" if is_global else "user"}
+        if is_global:
+            headers["X-RateLimit-Global"] = "true"
+        if bucket is not None:
+            headers.update(bucket)
+        return web.json_response({"message": "You are being rate limited.", "retry_after": retry_after,
+                                  "global": is_global}, status=429, headers=headers)
+
+    async def check(self, request, route):
+        major = request.match_info.get("guild_id") or request.match_info.get("channel_id") \
+            or request.match_info.get("token")
+        key = (route, major)
+        now = time.monotonic()
+        reset_at, remaining = self.buckets.get(key, (0.0, 0))
+        if now >= reset_at:
+            reset_at, remaining = now + self.bucket_window, self.bucket_limit
+        headers = {
+            "X-RateLimit-Limit": str(self.bucket_limit),
+            "X-RateLimit-Reset-After": f"{reset_at - now:.3f}",
+            "X-RateLimit-Bucket": hashlib.md5(route.encode()).hexdigest()[:16],
+        }
+        if remaining <= 0:
+            headers["X-RateLimit-Remaining"] = "0"
+            return self.rate_limited(reset_at - now, bucket=headers)
+        self.buckets[key] = (reset_at, remaining - 1)
+        headers["X-RateLimit-Remaining"] = str(remaining - 1)
+        request["ratelimit_headers"] = headers
+
+        if self.rng.random() < self.rate_limit_rate:
+            return self.rate_limited(self.rng.uniform(0.05, 1.0), self.rng.random() < self.global_share)
+        if self.rng.random() < self.error_rate:
+            self.stats["injected errors"] += 1
+            return web.json_response({"message": "500: Internal Server Error", "code": 0}, status=500)
+        return None
+
+    def respond(self, request, body=None, status=200):
+        headers = request.get("ratelimit_headers", {})
+        if status == 204:
+            return web.Response(status=204, headers=headers)
+        return web.json_response(body, status=status, headers=headers)
+
+    # Emojis
+
+    async def list_emojis(self, request):
+        return self.respond(request, self.emojis.get(request.match_info["guild_id"], []))
+
+    async def create_emoji(self, request):
+        guild_emojis = self.emojis.setdefault(request.match_info["guild_id"], [])
+        payload = await request.json()
+        if self.emoji_limit and len(guild_emojis) >= self.emoji_limit:
+            return self.respond(request, {"message": f"Maximum number of emojis reached ({self.emoji_limit})",
+                                          "code": 30008}, status=400)
+        if not payload.get("name") or not str(payload.get("image", "")).startswith("data:image/"):
+            return self.respond(request, {"message": "Invalid Form Body", "code": 50035}, status=400)
+        emoji = {"id": self.snowflake(), "name": payload["name"], "roles": [], "require_colons": True,
+                 "managed": False, "animated": False, "available": True}
+        guild_emojis.append(emoji)
+        return self.respond(request, emoji, status=201)
+
+    # Channels
+
+    def message(self, channel_id, payload):
+        return {"id": self.snowflake(), "channel_id": channel_id, "type": 0,
+                "content": payload.get("content") or "", "embeds": payload.get("embeds") or [],
+                "components": payload.get("components") or [], "attachments": [],
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime()),
+                "author": {"id": "1", "username": "bot", "bot": True}}
+
+    async def create_message(self, request):
+        channel_id = request.match_info["channel_id"]
+        message = self.message(channel_id, await request.json())
+        self.messages.setdefault(channel_id, []).append(message)
+        return self.respond(request, message)
+
+    async def list_messages(self, request):
+        messages = self.messages.get(request.match_info["channel_id"], [])
+        limit = min(int(request.query.get("limit", 50)), 100)
+        if "after" in request.query:
+            after = int(request.query["after"])
+            page = [message for message in messages if int(message["id"]) > after][:limit]
+        else:
+            before = int(request.query.get("before", 1 << 63))
+            page = [message for message in messages if int(message["id"]) < before][-limit:]
+        return self.respond(request, list(reversed(page)))
+
+    async def modify_channel(self, request):
+        payload = await request.json()
+        return self.respond(request, {"id": request.match_info["channel_id"], "type": 0,
+                                      "name": payload.get("name", "channel")})
+
+    async def delete_channel(self, request):
+        self.messages.pop(request.match_info["channel_id"], None)
+        return self.respond(request, {"id": request.match_info["channel_id"], "type": 0})
+
+    # Interactions
+
+    async def interaction_callback(self, request):
+        await request.json()
+        return self.respond(request, status=204)
+
+    async def followup(self, request):
+        return self.respond(request, self.message("0", await request.json()))
+
+    def app(self):
+        return self.application(DISCORD_PREFIX, [
+            ("GET", "/guilds/{guild_id}/emojis", self.list_emojis),
+            ("POST", "/guilds/{guild_id}/emojis", self.create_emoji),
+            ("GET", "/channels/{channel_id}/messages", self.list_messages),
+            ("POST", "/channels/{channel_id}/messages", self.create_message),
+            ("PATCH", "/channels/{channel_id}", self.modify_channel),
+            ("DELETE", "/channels/{channel_id}", self.delete_channel),
+            ("POST", "/interactions/{interaction_id}/{token}/callback", self.interaction_callback),
+            ("POST", "/webhooks/{application_id}/{token}", self.followup),
+            ("PATCH", "/webhooks/{application_id}/{token}/messages/{message_id}", self.followup),
+        ])
+
+
+# ------------------- Clash of Clans -------------------
+
+
+class CocStandIn(StandIn):
+    """The CoC player and clan endpoints, plus the badge and league images.
+
+    Each token may make `rate_limit` requests per second (0 for no limit)
+    before getting 429 requestThrottled, like a developer key. Bodies are
+    generated from the tag, so the same tag always returns the same player.
+    """
+
+    def __init__(self, latency="fixed:0", rate_limit=0, rate_limit_rate=0.0, error_rate=0.0,
+                 failing_tags=0.0, cache_max_age=60, seed=None):
+        super().__init__(latency, rate_limit_rate, error_rate, seed)
+        self.rate_limit = rate_limit
+        self.failing_tags = failing_tags
+        self.cache_max_age = cache_max_age
+        self.recent = {}  # token -> deque of request times in the last second
+        self.base_url = ""  # Set once the server is listening, for asset URLs
+
+    def gateway_error(self, reason):
+        self.stats[reason] += 1
+        status = self.rng.choice((502, 504))
+        return web.Response(status=status, content_type="text/html",
+                            text=f"<html><body><h1>{status} Gateway Error</h1></body></html>")
+
+    async def check(self, request, route):
+        if "/assets/" in request.path:
+            return None
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not token:
+            return web.json_response({"reason": "accessDenied", "message": "Invalid authorization"}, status=403)
+        if self.rate_limit:
+            now = time.monotonic()
+            recent = self.recent.setdefault(token, deque())
+            while recent and recent[0] <= now - 1:
+                recent.popleft()
+            if len(recent) >= self.rate_limit:
+                self.stats["throttled 429"] += 1
+                return web.json_response({"reason": "requestThrottled",
+                                          "message": "Request was throttled, because amount of requests was above the threshold defined for the used API token."},
+                                         status=429)
+            recent.append(now)
+        if self.rng.random() < self.rate_limit_rate:
+            self.stats["injected 429"] += 1
+            return web.json_response({"reason": "requestThrottled", "message": "Request was throttled"}, status=429)
+        tag = request.match_info.get("tag", "")
+        if tag and self.failing_tags and zlib.crc32(tag.encode()) % 10_000 < self.failing_tags * 10_000:
+            return self.gateway_error("failing tag errors")
+        if self.rng.random() < self.error_rate:
+            return self.gateway_error("injected errors")
+        return None
+
+    def respond(self, body):
+        headers = {"Cache-Control": f"public max-age={self.cache_max_age}"} if self.cache_max_age else {}
+        return web.json_response(body, headers=headers)
+
+    def badge_urls(self, key):
+        return {size: f"{self.base_url}/assets/badges/{size}/{key}.png" for size in ("small", "medium", "large")}
+
+    def league(self, rng):
+        league_id, name = rng.choice(((29000022, "Legend League"), (29000021, "Titan League I"),
+                                      (29000018, "Champion League I"), (29000015, "Master League I")))
+        return {"id": league_id, "name": name,
+                "iconUrls": {size: f"{self.base_url}/assets/leagues/{size}/{league_id}.png"
+                             for size in ("tiny", "small", "medium")}}
+
+    def clan_reference(self, tag):
+        rng = random.Random(tag)
+        return {"tag": tag, "name": f"Clan {tag[1:]}", "clanLevel": rng.randint(1, 30),
+                "badgeUrls": self.badge_urls(tag[1:])}
+
+    async def get_player(self, request):
+        tag = request.match_info["tag"].upper()
+        rng = random.Random(tag)
+        trophies = rng.randint(1000, 6000)
+        clan_tag = "#" + "".join(rng.choice("0289PYLQGRJCUV") for _ in range(8))
+        league = self.league(rng)  # Newer API versions call it leagueTier
+        return self.respond({
+            "tag": tag, "name": f"Player {tag[1:]}", "townHallLevel": rng.randint(9, 16),
+            "expLevel": rng.randint(100, 300), "trophies": trophies, "bestTrophies": trophies + rng.randint(0, 500),
+            "warStars": rng.randint(0, 2500), "attackWins": rng.randint(0, 300), "defenseWins": rng.randint(0, 50),
+            "builderHallLevel": rng.randint(1, 10), "builderBaseTrophies": rng.randint(0, 5000),
+            "role": rng.choice(("member", "admin", "coLeader", "leader")), "warPreference": "in",
+            "donations": rng.randint(0, 5000), "donationsReceived": rng.randint(0, 5000),
+            "clanCapitalContributions": rng.randint(0, 100000),
+            "clan": self.clan_reference(clan_tag), "league": league, "leagueTier": league,
+            "achievements": [], "labels": [], "troops": [], "heroes": [], "spells": [], "heroEquipment": [],
+        })
+
+    async def get_clan(self, request):
+        tag = request.match_info["tag"].upper()
+        rng = random.Random(tag)
+        members = []
+        for rank in range(1, rng.randint(10, 50) + 1):
+            member_tag = "#" + "".join(rng.choice("0289PYLQGRJCUV") for _ in range(8))
+            league = self.league(rng)
+            members.append({"tag": member_tag, "name": f"Player {member_tag[1:]}", "role": "member",
+                            "townHallLevel": rng.randint(9, 16), "expLevel": rng.randint(100, 300),
+                            "league": league, "leagueTier": league, "trophies": rng.randint(1000, 6000),
+                            "builderBaseTrophies": rng.randint(0, 5000), "clanRank": rank,
+                            "previousClanRank": rank, "donations": rng.randint(0, 3000),
+                            "donationsReceived": rng.randint(0, 3000)})
+        clan = self.clan_reference(tag)
+        clan.update({
+            "type": rng.choice(("open", "inviteOnly", "closed")), "description": f"Stand-in clan {tag}",
+            "clanPoints": rng.randint(10000, 50000), "clanBuilderBasePoints": rng.randint(10000, 50000),
+            "clanCapitalPoints": rng.randint(0, 5000), "requiredTrophies": rng.choice((0, 1000, 2000, 3000)),
+            "warFrequency": "always", "warWinStreak": rng.randint(0, 20), "warWins": rng.randint(0, 1000),
+            "warTies": rng.randint(0, 50), "warLosses": rng.randint(0, 300), "isWarLogPublic": True,
+            "members": len(members), "memberList": members, "labels": [],
+        })
+        return self.respond(clan)
+
+    async def get_asset(self, request):
+        return web.Response(body=PNG, content_type="image/png")
+
+    def app(self):
+        app = self.application(COC_PREFIX, [
+            ("GET", "/players/{tag}", self.get_player),
+            ("GET", "/clans/{tag}", self.get_clan),
+        ])
+        app.router.add_get("/assets/{path:.*}", self.get_asset)
+        return app
+
+
+# ------------------- Servers -------------------
+
+
+def add_arguments(parser):
+    """Stand-in options, shared with benchmarks/loadtest.py."""
+    group = parser.add_argument_group("stand-ins")
+    group.add_argument("--discord-latency", default="lognormal:40,0.5")
+    group.add_argument("--discord-bucket-limit", type=int, default=50, help="Requests per bucket window")
+    group.add_argument("--discord-bucket-window", type=float, default=1.0, help="Seconds")
+    group.add_argument("--discord-429-rate", type=float, default=0.0, help="Share of requests answered with a 429")
+    group.add_argument("--discord-global-share", type=float, default=0.1, help="Share of injected 429s that are global")
+    group.add_argument("--discord-error-rate", type=float, default=0.0, help="Share of requests answered with a 500")
+    group.add_argument("--emoji-limit", type=int, default=0, help="Emojis per guild, 0 for no limit")
+    group.add_argument("--coc-latency", default="lognormal:150,0.6")
+    group.add_argument("--coc-rate-limit", type=int, default=0, help="Requests per second per token, 0 for no limit")
+    group.add_argument("--coc-429-rate", type=float, default=0.0, help="Share of requests answered with a 429")
+    group.add_argument("--coc-error-rate", type=float, default=0.0, help="Share of requests answered with a 502/504")
+    group.add_argument("--coc-failing-tags", type=float, default=0.0, help="Share of tags that always 502/504")
+    group.add_argument("--coc-cache-max-age", type=int, default=60, help="Cache-Control max-age, 0 to omit")
+    group.add_argument("--seed", type=int, default=1)
+
+
+async def start_standins(args, host="127.0.0.1", discord_port=0, coc_port=0):
+    """Start both stand-ins; returns (discord, coc, runners, {setting: URL})."""
+    discord = DiscordStandIn(
+        args.discord_latency, args.discord_bucket_limit, args.discord_bucket_window, args.discord_429_rate,
+        args.discord_global_share, args.discord_error_rate, args.emoji_limit, seed=args.seed)
+    coc = CocStandIn(
+        args.coc_latency, args.coc_rate_limit, args.coc_429_rate, args.coc_error_rate, args.coc_failing_tags,
+        args.coc_cache_max_age, seed=args.seed + 1)
+    runners = []
+    ports = []
+    for app, port in ((discord.app(), discord_port), (coc.app(), coc_port)):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        runners.append(runner)
+        ports.append(runner.addresses[0][1])
+    coc.base_url = f"http://{host}:{ports[1]}"
+    settings = {
+        "DISCORD_API_BASE": f"http://{host}:{ports[0]}{DISCORD_PREFIX}",
+        "COC_API_BASE": f"http://{host}:{ports[1]}{COC_PREFIX}",
+        "COC_API_TOKENS": "standin-1,standin-2,standin-3,standin-4,standin-5",
+    }
+    return discord, coc, runners, settings
+
+
+async def serve(args):
+    _, _, runners, settings = await start_standins(args, args.host, args.discord_port, args.coc_port)
+    for name, value in settings.items():
+        print(f"{name}={value}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--discord-port", type=int, default=8081)
+    parser.add_argument("--coc-port", type=int, default=8082)
+    add_arguments(parser)
+    try:
+        asyncio.run(serve(parser.parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,132 @@
+# ------------------- Imports -------------------
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------- LRU Cache -------------------
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry."""
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        try:
+            self._entries.move_to_end(key)
+        except KeyError:
+            return default
+        return self._entries[key]
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._entries.pop(key, default)
+
+    def clear(self):
+        self._entries.clear()
+
+
+# ------------------- Single Flight -------------------
+
+
+async def single_flight(in_flight, key, factory):
+    """Run `factory()` once per key; concurrent callers await the same result.
+
+    `in_flight` is the dict holding the running task for each key. The task is
+    shielded, so a caller giving up does not cancel it for the others.
+    """
+    task = in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        in_flight[key] = task
+        task.add_done_callback(lambda _: in_flight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+# ------------------- TTL Cache -------------------
+
+
+class TTLCache:
+    """LRU-bounded async cache with a time-to-live and stale-while-revalidate.
+
+    A value younger than `ttl` is served as is. Up to `stale_ttl` seconds past
+    that it is still served straight away, while one background load refreshes
+    it. Older entries (and misses) are loaded inline; concurrent loads of the
+    same key are coalesced.
+    """
+
+    def __init__(self, ttl, max_size=1024, stale_ttl=0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries = LRUCache(max_size)  # key -> (loaded at, value)
+        self._in_flight = {}
+
+    async def get(self, key, loader):
+        """Return the cached value for `key`, calling `await loader(key)` when needed."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.hits += 1
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._revalidate(key, loader)
+                return entry[1]
+        self.misses += 1
+        return await single_flight(self._in_flight, key, lambda: self._load(key, loader))
+
+    def _revalidate(self, key, loader):
+        if key in self._in_flight:
+            return
+        task = asyncio.ensure_future(self._load(key, loader))
+        self._in_flight[key] = task
+        task.add_done_callback(self._revalidated(key))
+
+    def _revalidated(self, key):
+        def done(task):
+            self._in_flight.pop(key, None)
+            if not task.cancelled() and task.exception() is not None:
+                # Keep serving the stale value; the next get retries the load.
+                logger.warning("Background refresh of %r failed", key, exc_info=task.exception())
+        return done
+
+    async def _load(self, key, loader):
+        value = await loader(key)
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self._entries.put(key, (time.monotonic(), value))
+
+    def invalidate(self, key):
+        self._entries.pop(key)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+        }
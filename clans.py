@@ -0,0 +1,131 @@
+# ------------------- Imports -------------------
+import logging
+from activity import WINDOWS, ActivityCounter
+
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Schema -------------------
+SCHEMA_VERSION = 2
+
+# Persisted scalar field -> converter applied on load. Every field may also be
+# None; "activity" (the ActivityCounter) is stored alongside these.
+SCHEMA = {
+    "name": str,
+    "default_channel": int,
+    "leader_role": int,
+    "clan_role": int,
+    "requirement": str,
+    "messages": int,
+    "counted_through": int,  # The activity ring holds every message up to this id
+    "activity_score": float,
+}
+_RESERVED = set(SCHEMA) | {"version", "activity"}
+
+
+def _migrate_v0(record):
+    """The untyped layout: no "version", window totals stored next to the ring."""
+    return {key: value for key, value in record.items() if key not in WINDOWS}
+
+
+def _migrate_v1(record):
+    """last_message_id was moved by live messages even with a gap before them,
+    so it can skip messages posted while the bot was down. Drop it; the clan
+    gets one full backfill and a counted_through checkpoint."""
+    return {key: value for key, value in record.items() if key != "last_message_id"}
+
+
+# Version found on disk -> function bringing a record up to the next version
+MIGRATIONS = {
+    0: _migrate_v0,
+    1: _migrate_v1,
+}
+
+
+def migrate(record):
+    version = record.get("version", 0)
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"Clan record version {version} is newer than this bot ({SCHEMA_VERSION})")
+    while version < SCHEMA_VERSION:
+        record = MIGRATIONS[version](record)
+        version += 1
+    return record
+
+
+# ------------------- Clan Record -------------------
+
+
+class ClanRecord:
+    """One clan's settings and activity state.
+
+    The window totals ("lastdaymessages", ...) are not stored; read them from
+    `activity`, which keeps them current.
+    """
+
+    __slots__ = ("name", "default_channel", "leader_role", "clan_role", "requirement",
+                 "messages", "counted_through", "activity_score", "activity", "extra")
+
+    def __init__(self, name="", default_channel=None, leader_role=None, clan_role=None,
+                 requirement="", messages=0, counted_through=None, activity_score=0.0,
+                 activity=None, extra=None):
+        self.name = name
+        self.default_channel = default_channel
+        self.leader_role = leader_role
+        self.clan_role = clan_role
+        self.requirement = requirement
+        self.messages = messages
+        self.counted_through = counted_through
+        self.activity_score = activity_score
+        self.activity = activity if activity is not None else ActivityCounter()
+        self.extra = extra  # Keys outside SCHEMA found on load, written back untouched
+
+    def record_message(self, timestamp=None):
+        self.messages += 1
+        self.activity.record(timestamp)
+
+    def forget_message(self, timestamp):
+        if self.messages > 0:
+            self.messages -= 1
+        self.activity.record(timestamp, delta=-1)
+
+    def to_dict(self):
+        record = {
+            "version": SCHEMA_VERSION,
+            "name": self.name,
+            "default_channel": self.default_channel,
+            "leader_role": self.leader_role,
+            "clan_role": self.clan_role,
+            "requirement": self.requirement,
+            "messages": self.messages,
+            "counted_through": self.counted_through,
+            "activity_score": self.activity_score,
+            "activity": self.activity.to_dict(),
+        }
+        if self.extra:
+            record.update(self.extra)
+        return record
+
+    @classmethod
+    def from_dict(cls, record, tag=None):
+        """Build a record from any stored version, migrating it first.
+
+        Fields that do not convert to their SCHEMA type are logged and reset
+        to their default rather than losing the whole clan.
+        """
+        record = migrate(record)
+        values = {}
+        for field, convert in SCHEMA.items():
+            value = record.get(field)
+            if value is None:
+                continue
+            try:
+                values[field] = convert(value)
+            except (TypeError, ValueError):
+                logger.warning("Clan %s: dropping invalid %s %r", tag, field, value)
+        try:
+            activity = ActivityCounter.from_dict(record.get("activity"))
+        except (TypeError, ValueError):
+            logger.warning("Clan %s: activity history unreadable, it will be backfilled", tag)
+            activity = ActivityCounter()
+        extra = {key: value for key, value in record.items() if key not in _RESERVED}
+        return cls(activity=activity, extra=extra or None, **values)
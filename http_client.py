@@ -0,0 +1,150 @@
+# ------------------- Imports -------------------
+import asyncio
+import re
+import time
+import aiohttp
+
+
+DISCORD_API_BASE = "https://discord.com/api/v10"
+
+# Discord shares a bucket between routes per "major parameter"
+MAJOR_PARAMETER = re.compile(r"^/(guilds|channels|webhooks)/(\d+)")
+
+
+class DiscordHTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Status: {status}, Message: {message}")
+        self.status = status
+        self.message = message
+
+
+class RateLimitBucket:
+    __slots__ = ("limit", "remaining", "reset_at", "in_flight", "lock")
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None  # Unknown until Discord sends the headers
+        self.reset_at = 0.0
+        self.in_flight = 0
+        self.lock = asyncio.Lock()
+
+
+# ------------------- HTTP Client -------------------
+
+
+class DiscordHTTPClient:
+    """One pooled aiohttp session shared by the raw Discord REST helpers.
+
+    Each request reserves one of its rate-limit bucket's remaining requests
+    (buckets are learned from the X-RateLimit-Bucket header) and waits for
+    the bucket to reset once none are left. Requests are retried after
+    Retry-After on a 429.
+    """
+
+    def __init__(self, token, base_url=DISCORD_API_BASE, pool_size=20, max_retries=3):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.session = None
+        self._route_buckets = {}  # "METHOD /path" -> bucket hash
+        self._buckets = {}  # (bucket hash or route, major parameter) -> RateLimitBucket
+        self._global_reset_at = 0.0
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def _bucket_for(self, method, path):
+        route = f"{method} {path}"
+        major = MAJOR_PARAMETER.match(path)
+        key = (self._route_buckets.get(route, route), major.group(0) if major else None)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = RateLimitBucket()
+        return route, major, bucket
+
+    def _update_bucket(self, route, major, bucket, headers):
+        bucket_hash = headers.get("X-RateLimit-Bucket")
+        if bucket_hash and self._route_buckets.get(route) != bucket_hash:
+            self._route_buckets[route] = bucket_hash
+            self._buckets.setdefault((bucket_hash, major.group(0) if major else None), bucket)
+        limit = headers.get("X-RateLimit-Limit")
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if limit is not None:
+            bucket.limit = int(limit)
+        if remaining is not None:
+            # The other requests in flight have already reserved their share,
+            # and Discord may not have counted them yet
+            bucket.remaining = max(0, int(remaining) - (bucket.in_flight - 1))
+        if reset_after is not None:
+            bucket.reset_at = time.monotonic() + float(reset_after)
+
+    async def _wait_for(self, reset_at):
+        delay = reset_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _reserve(self, bucket):
+        """Wait until the bucket has a request left and take it.
+
+        Only this holds the bucket lock; the request itself is sent without
+        it, so requests left in a bucket go out concurrently.
+        """
+        async with bucket.lock:
+            await self._wait_for(self._global_reset_at)
+            if bucket.remaining is not None and bucket.remaining <= 0:
+                await self._wait_for(bucket.reset_at)
+                bucket.remaining = bucket.limit
+            if bucket.remaining is not None:
+                bucket.remaining -= 1
+            bucket.in_flight += 1
+
+    async def request(self, method, path, json=None):
+        """Send an authorised request to the Discord API and return the decoded body."""
+        session = await self.start()
+        route, major, bucket = self._bucket_for(method, path)
+        headers = {"Authorization": f"Bot {self.token}"}
+
+        for attempt in range(self.max_retries + 1):
+            await self._reserve(bucket)
+            try:
+                async with session.request(method, self.base_url + path, headers=headers, json=json) as response:
+                    self._update_bucket(route, major, bucket, response.headers)
+                    if response.status == 429 and attempt < self.max_retries:
+                        try:
+                            body = await response.json()
+                        except (aiohttp.ContentTypeError, ValueError):
+                            body = {}
+                        retry_after = float(body.get("retry_after")
+                                            or response.headers.get("Retry-After", 1))
+                        reset_at = time.monotonic() + retry_after
+                        if body.get("global") or response.headers.get("X-RateLimit-Global"):
+                            self._global_reset_at = reset_at
+                        else:
+                            bucket.remaining = 0
+                            bucket.reset_at = reset_at
+                        continue
+                    if 200 <= response.status < 300:
+                        if response.status == 204:
+                            return None
+                        return await response.json()
+                    raise DiscordHTTPError(response.status, await response.text())
+            finally:
+                bucket.in_flight -= 1
+
+    async def fetch_bytes(self, url):
+        """Download a file (e.g. a badge image) over the shared pool, without auth headers."""
+        session = await self.start()
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise DiscordHTTPError(response.status, await response.text())
+            return await response.read()
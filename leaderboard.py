@@ -0,0 +1,47 @@
+# ------------------- Imports -------------------
+from bisect import bisect_left, insort
+
+
+# ------------------- Leaderboard -------------------
+
+
+class ActivityLeaderboard:
+    """Clans ranked by activity score, kept sorted in memory.
+
+    Entries are (-score, tag) tuples in a sorted list, so a score change is a
+    binary search plus one insert, and reading a page is a slice.
+    """
+
+    def __init__(self):
+        self._ranked = []
+        self._scores = {}
+
+    def __len__(self):
+        return len(self._ranked)
+
+    def rebuild(self, clan_data):
+        self._scores = {tag: info.activity_score for tag, info in clan_data.items()}
+        self._ranked = sorted((-score, tag) for tag, score in self._scores.items())
+
+    def update(self, tag, score):
+        old = self._scores.get(tag)
+        if old == score:
+            return
+        if old is not None:
+            del self._ranked[bisect_left(self._ranked, (-old, tag))]
+        self._scores[tag] = score
+        insort(self._ranked, (-score, tag))
+
+    def remove(self, tag):
+        old = self._scores.pop(tag, None)
+        if old is not None:
+            del self._ranked[bisect_left(self._ranked, (-old, tag))]
+
+    def page_count(self, page_size):
+        return max(1, -(-len(self._ranked) // page_size))
+
+    def page(self, page, page_size):
+        """Return [(rank, tag, score), ...] for a zero-based page."""
+        start = page * page_size
+        return [(start + i + 1, tag, -negative_score)
+                for i, (negative_score, tag) in enumerate(self._ranked[start:start + page_size])]
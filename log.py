@@ -0,0 +1,85 @@
+# ------------------- Imports -------------------
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+
+# Structured fields handlers may pass through `extra=`
+FIELDS = ("handler", "guild", "channel", "clan_tag")
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class StructuredFormatter(logging.Formatter):
+    """Appends any FIELDS set on the record as key=value pairs."""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = " ".join(f"{field}={getattr(record, field)}"
+                          for field in FIELDS if getattr(record, field, None) is not None)
+        return f"{line} [{fields}]" if fields else line
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a `sample` fraction of records that set extra={"sample": rate}."""
+
+    def filter(self, record):
+        rate = getattr(record, "sample", None)
+        return rate is None or random.random() < rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread without formatting them first.
+
+    Only the message interpolation (and any traceback text) happens on the
+    calling thread; timestamps, fields and the write itself are the
+    listener's job.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# ------------------- Setup -------------------
+_listener = None
+
+
+def setup_logging(level=None, stream=None):
+    """Route the root logger through a queue drained by a background thread."""
+    global _listener
+    if _listener is not None:
+        return _listener
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(StructuredFormatter(LOG_FORMAT))
+
+    records = queue.SimpleQueue()
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
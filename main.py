@@ -1,21 +1,36 @@
 # ------------------- Imports -------------------
 from interactions import Embed
-import json
 import os
 import asyncio
-import aiohttp
 import base64
 import re
+import random
 import coc
 import datetime
 from pytz import utc
 from coc import GatewayError
-import traceback
+import logging
+import time
 from dotenv import load_dotenv
 from interactions import (Client, listen, slash_command, slash_option,
-                          Embed, OptionType, Button, ActionRow, ButtonStyle, SlashContext, StringSelectMenu, ComponentContext, component_callback)
+                          Embed, OptionType, Permissions, Button, ActionRow, ButtonStyle, SlashContext, StringSelectMenu, ComponentContext, component_callback)
 from interactions.api.events import Component
+from interactions.api.http.route import Route
 from bot import bot, coc_client
+from log import setup_logging
+from metrics import MetricsRegistry, start_metrics_server
+from activity import ActivityCounter, snowflake_time
+from clans import ClanRecord
+from http_client import DISCORD_API_BASE, DiscordHTTPClient, DiscordHTTPError
+from cache import LRUCache, TTLCache, single_flight
+from storage import Storage
+from player_links import PlayerLinkStore
+from leaderboard import ActivityLeaderboard
+from scoring import ActivityScorer
+from scheduler import CocScheduler, INTERACTIVE, BULK, BACKGROUND
+from snapshots import SnapshotStore
+from tickets import (TicketStore, new_ticket, STEP_OPENED, STEP_CHOOSING_ACCOUNTS,
+                     STEP_AWAITING_TAG, STEP_AWAITING_SCREENSHOT, STEP_COMPLETED)
 
 
 # ------------------- Load Environment Variables -------------------
@@ -23,10 +38,26 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 Email = os.getenv("Email")
 Password = os.getenv("Password")
+# Point these at local stand-ins for load tests, see benchmarks/standins.py.
+# DISCORD_API_BASE also moves the library's own REST calls (Route.BASE).
+COC_API_BASE = os.getenv("COC_API_BASE", "https://api.clashofclans.com/v1")
+COC_API_TOKENS = [token for token in os.getenv("COC_API_TOKENS", "").split(",") if token]
+COC_KEY_COUNT = len(COC_API_TOKENS) or int(os.getenv("COC_KEY_COUNT", 5))
+COC_KEY_RATE = float(os.getenv("COC_KEY_RATE", 30))  # Requests per second each key may make
+if os.getenv("DISCORD_API_BASE"):
+    DISCORD_API_BASE = Route.BASE = os.getenv("DISCORD_API_BASE")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))  # 0 disables the endpoint
 
 # ------------------- Initialize Global Variables -------------------
+setup_logging()
+logger = logging.getLogger("bot")
+metrics = MetricsRegistry()
+metrics_server = None
+# Fraction of per-message debug lines kept when LOG_LEVEL=DEBUG
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+discord_http = DiscordHTTPClient(BOT_TOKEN, base_url=DISCORD_API_BASE)
 embed_colour = 0x00ff00  # Default to green
-player_tags = {}  # Initialize empty dictionary for player tags
 clan_data = {}
 COLOURS = {
     "Red": 0xFF0000,
@@ -38,40 +69,170 @@ COLOURS = {
 }
 
 # ------------------- Utility Functions -------------------
-# JSON Handling
+# Storage Handling
+storage = Storage(os.getenv("DATABASE_PATH", "bot_data.db")).connect()
+storage.migrate_json_files()
 
 
 def load_clan_data():
-    with open('clans_data.json', 'r') as f:
-        return json.load(f)
+    return {tag: ClanRecord.from_dict(record, tag) for tag, record in storage.load_clans().items()}
 
 
-try:
-    clan_data = load_clan_data()
-    if not isinstance(clan_data, dict):
-        clan_data = {}
-except FileNotFoundError:
-    clan_data = {}
+# default_channel id -> clan tag, so listeners resolve a message in one lookup
+clan_channel_index = {}
 
 
-def save_clan_data(data):
-    serializable_data = {}
-    for key, value in data.items():
-        if isinstance(value, dict):
-            serializable_data[key] = {}
-            for sub_key, sub_value in value.items():
+def rebuild_clan_channel_index():
+    clan_channel_index.clear()
+    for clan_tag, clan_info in clan_data.items():
+        if clan_info.default_channel is not None:
+            clan_channel_index[clan_info.default_channel] = clan_tag
+
+
+clan_data = load_clan_data()
+rebuild_clan_channel_index()
+activity_leaderboard = ActivityLeaderboard()
+activity_leaderboard.rebuild(clan_data)
+activity_scorer = ActivityScorer(
+    mode=os.getenv("ACTIVITY_SCORE_MODE", "windows"),
+    weights=[float(weight) for weight in os.getenv("ACTIVITY_WEIGHTS", "0.4,0.3,0.2,0.1").split(",")],
+    half_life_hours=float(os.getenv("ACTIVITY_HALF_LIFE_HOURS", 72)))
+
+
+def set_activity_score(clan_tag, activity_score):
+    if clan_tag not in clan_data:
+        return  # Removed while it was being scored
+    clan_data[clan_tag].activity_score = activity_score
+    activity_leaderboard.update(clan_tag, activity_score)
+
+
+def rank_clans():
+    """Bring every clan's score and leaderboard place up to date.
+
+    The scorer memoises unchanged counters, so only clans with new messages
+    since they were last scored are recomputed.
+    """
+    scores = activity_scorer.score_all(
+        {clan_tag: clan_info.activity for clan_tag, clan_info in clan_data.items()})
+    for clan_tag, activity_score in scores.items():
+        set_activity_score(clan_tag, activity_score)
+
+
+class ClanDataWriter:
+    """Write-behind buffer for the clans table.
+
+    save_clan_data() only marks clans dirty; saves are merged and flushed
+    every `interval` seconds, or straight away once `max_pending` saves have
+    piled up. A flush upserts just the dirty clans on the storage thread.
+    """
+
+    def __init__(self, storage, interval=5.0, max_pending=100):
+        self.storage = storage
+        self.interval = interval
+        self.max_pending = max_pending
+        self.data = None
+        self.pending = 0
+        self.dirty = set()
+        self.replace_all = False
+        self.flushes = 0
+        self.merged_writes = 0
+        self.last_flush_duration = 0.0
+        self._timer = None
+        self._lock = None
+        self._tasks = set()
+
+    def mark_dirty(self, data, clan_tags=()):
+        self.data = data
+        self.pending += 1
+        if clan_tags:
+            self.dirty.update(clan_tags)
+        else:
+            self.replace_all = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (startup/shutdown): nothing to batch with.
+            self.flush_sync()
+            return
+        if self.pending >= self.max_pending:
+            self._cancel_timer()
+            self._spawn(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.interval, self._spawn, loop)
+
+    def _spawn(self, loop):
+        self._timer = None
+        task = loop.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _take_snapshot(self):
+        merged, tags, replace_all = self.pending, self.dirty, self.replace_all
+        self.pending, self.dirty, self.replace_all = 0, set(), False
+        if replace_all:
+            tags = self.data.keys()
+        records = {tag: self.data[tag].to_dict() for tag in tags if tag in self.data}
+        removed = [tag for tag in tags if tag not in self.data]
+        return merged, (records, removed, replace_all)
+
+    def _restore(self, merged, snapshot):
+        records, removed, replace_all = snapshot
+        self.pending += merged
+        self.dirty.update(records, removed)
+        self.replace_all = self.replace_all or replace_all
+
+    def _record_flush(self, merged, started, snapshot):
+        self.flushes += 1
+        self.merged_writes += merged - 1
+        self.last_flush_duration = time.perf_counter() - started
+        logger.info("Flushed clan data: %d save(s) merged into 1 write of %d clan(s) in %.1f ms",
+                    merged, len(snapshot[0]), self.last_flush_duration * 1000)
+
+    async def flush(self):
+        self._cancel_timer()
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.pending:
+                return
+            started = time.perf_counter()
+            merged, snapshot = self._take_snapshot()
+            try:
+                await self.storage.run(self.storage.write_clans, *snapshot)
+            except Exception:
+                self._restore(merged, snapshot)
+                logger.exception("Failed to flush clan data")
+                return
+            self._record_flush(merged, started, snapshot)
+
+    def flush_sync(self):
+        self._cancel_timer()
+        if not self.pending:
+            return
+        started = time.perf_counter()
+        merged, snapshot = self._take_snapshot()
+        try:
+            self.storage.write_clans(*snapshot)
+        except Exception:
+            self._restore(merged, snapshot)
+            raise
+        self._record_flush(merged, started, snapshot)
 
-                if hasattr(sub_value, 'id'):
 
-                    serializable_data[key][sub_key] = sub_value.id
-                else:
+clan_data_writer = ClanDataWriter(
+    storage,
+    interval=float(os.getenv("CLAN_SAVE_INTERVAL", 5)),
+    max_pending=int(os.getenv("CLAN_SAVE_MAX_PENDING", 100)))
 
-                    serializable_data[key][sub_key] = sub_value
-        else:
-            serializable_data[key] = value
 
-    with open('clans_data.json', 'w') as f:
-        json.dump(serializable_data, f, indent=4)
+def save_clan_data(data, *clan_tags):
+    """Queue a save of `clan_tags` (every clan when none are given)."""
+    clan_data_writer.mark_dirty(data, clan_tags)
 
 
 # ------------------- Embed Handling -------------------
@@ -79,43 +240,26 @@ def save_clan_data(data):
 
 def load_embed_colour():
     global embed_colour
-    try:
-        with open('embed_colour.json', 'r') as f:
-            embed_colour = json.load(f)
-    except FileNotFoundError:
-        pass
+    embed_colour = storage.get_setting("embed_colour", embed_colour)
 
 
 def save_embed_colour(colour):
     global embed_colour
     embed_colour = colour
-    with open('embed_colour.json', 'w') as f:
-        json.dump(embed_colour, f)
+    embed_render_cache.pop("clan", None)  # Rendered with the old colour
+    storage.submit(storage.set_setting, "embed_colour", embed_colour)
 
 # ------------------- Player Handling -------------------
 
 
-def load_tags_from_file():
-    try:
-        with open('player_tags.json', 'r') as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
-
+# Loaded once at startup; user -> tags and tag -> user lookups are both O(1)
+player_links = PlayerLinkStore(storage, normalize=coc.utils.correct_tag).load()
 
-def save_tags_to_file(tags):
-    with open('player_tags.json', 'w') as file:
-        json.dump(tags, file)
 # ------------------- Clan Handling -------------------
 
 
 def load_clan_tags():
-    try:
-        with open('clans_data.json', 'r') as f:
-            data = json.load(f)
-        return [{"name": tag, "value": tag} for tag in data.keys()]
-    except FileNotFoundError:
-        return []
+    return [{"name": tag, "value": tag} for tag in clan_data.keys()]
 
 
 clan_tags_choices = load_clan_tags()
@@ -123,67 +267,214 @@ clan_tags_choices = load_clan_tags()
 # ------------------- Async Functions -------------------
 
 
+@metrics.timed("discord_rest")
 async def get_guild_emojis(guild_id):
-    url = f"https://discord.com/api/v10/guilds/{guild_id}/emojis"
-    headers = {
-        "Authorization": f"Bot {BOT_TOKEN}"
-    }
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            if response.status == 200:
-                return await response.json()
-            else:
-                raise Exception(f"Failed to fetch emojis. Status: {response.status}, Message: {await response.text()}")
+    try:
+        return await discord_http.request("GET", f"/guilds/{guild_id}/emojis")
+    except DiscordHTTPError as e:
+        raise Exception(f"Failed to fetch emojis. Status: {e.status}, Message: {e.message}")
+
+
+EMOJI_CACHE_TTL = int(os.getenv("EMOJI_CACHE_TTL", 3600))
+guild_emoji_cache = {}  # guild id -> (expires at, {emoji name: emoji})
+
+
+# In-flight work shared by concurrent lookups, see cache.single_flight
+emoji_index_requests = {}  # guild id -> task
+emoji_provisioning = {}  # (guild id, emoji name) -> task
+badge_image_requests = {}  # image url -> task
+badge_image_cache = LRUCache(
+    max_size=int(os.getenv("BADGE_IMAGE_CACHE_SIZE", 128)))
+
+
+async def get_guild_emoji_index(guild_id):
+    guild_id = int(guild_id)
+    cached = guild_emoji_cache.get(guild_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    async def fetch_index():
+        emojis = await get_guild_emojis(guild_id)
+        index = {emoji['name']: emoji for emoji in emojis}
+        guild_emoji_cache[guild_id] = (time.monotonic() + EMOJI_CACHE_TTL, index)
+        return index
+
+    return await single_flight(emoji_index_requests, guild_id, fetch_index)
+
 
+async def fetch_badge_image(image_url):
+    image_data = badge_image_cache.get(image_url)
+    if image_data is not None:
+        return image_data
 
+    async def download():
+        # Timed here rather than on the function, so cache hits stay out of the histogram
+        data = await metrics.call("discord_rest", "fetch_badge_image", discord_http.fetch_bytes, image_url)
+        badge_image_cache.put(image_url, data)
+        return data
+
+    return await single_flight(badge_image_requests, image_url, download)
+
+
+async def ensure_guild_emoji(guild_id, name, image_url):
+    """Return the guild's emoji called `name`, creating it from `image_url` if missing.
+
+    Concurrent calls for the same guild and name share one download and create.
+    """
+    emoji = (await get_guild_emoji_index(guild_id)).get(name)
+    if emoji is not None:
+        return emoji
+    return await single_flight(
+        emoji_provisioning, (int(guild_id), name),
+        lambda: create_custom_emoji_via_api(guild_id, name, image_url))
+
+
+@metrics.timed("discord_rest")
 async def create_custom_emoji_via_api(guild_id, name, image_url):
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(image_url) as response:
-            image_data = await response.read()
+    image_data = await fetch_badge_image(image_url)
     encoded_image_data = base64.b64encode(image_data).decode('utf-8')
-    url = f"https://discord.com/api/v10/guilds/{guild_id}/emojis"
-    headers = {
-        "Authorization": f"Bot {BOT_TOKEN}",
-        "Content-Type": "application/json"
-    }
     payload = {
         "name": name,
         "image": f"data:image/png;base64,{encoded_image_data}"
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=payload) as response:
-            if response.status == 201:
-                return await response.json()
-            else:
-                raise Exception(f"Failed to create emoji. Status: {response.status}, Message: {await response.text()}")
+    try:
+        emoji = await discord_http.request("POST", f"/guilds/{guild_id}/emojis", json=payload)
+    except DiscordHTTPError as e:
+        raise Exception(f"Failed to create emoji. Status: {e.status}, Message: {e.message}")
+    cached = guild_emoji_cache.get(int(guild_id))
+    if cached:
+        cached[1][emoji['name']] = emoji
+    return emoji
+
+
+player_cache = TTLCache(
+    ttl=int(os.getenv("PLAYER_CACHE_TTL", 60)),
+    stale_ttl=int(os.getenv("PLAYER_CACHE_STALE_TTL", 600)),
+    max_size=int(os.getenv("PLAYER_CACHE_SIZE", 2048)))
+clan_cache = TTLCache(
+    ttl=int(os.getenv("CLAN_CACHE_TTL", 300)),
+    stale_ttl=int(os.getenv("CLAN_CACHE_STALE_TTL", 1800)),
+    max_size=int(os.getenv("CLAN_CACHE_SIZE", 512)))
+
+
+# Every CoC API call queues here, so background jobs wait behind users
+coc_scheduler = CocScheduler(
+    key_count=COC_KEY_COUNT, rate=COC_KEY_RATE,
+    concurrency=int(os.getenv("COC_MAX_IN_FLIGHT", 20)), metrics=metrics)
+
+
+async def fetch_player(tag):
+    return await metrics.call("coc", "get_player", coc_client.get_player, tag)
+
+
+async def fetch_clan(tag):
+    return await metrics.call("coc", "get_clan", coc_client.get_clan, tag)
+
+
+async def get_player(tag, priority=INTERACTIVE):
+    tag = coc.utils.correct_tag(tag)
+    # Waiting on a load a background job queued? Move it up to our class
+    coc_scheduler.promote(("player", tag), priority)
+    return await player_cache.get(tag, lambda t: coc_scheduler.submit(("player", t), fetch_player, t, priority=priority))
+
+
+async def get_clan(tag, priority=INTERACTIVE):
+    tag = coc.utils.correct_tag(tag)
+    coc_scheduler.promote(("clan", tag), priority)
+    return await clan_cache.get(tag, lambda t: coc_scheduler.submit(("clan", t), fetch_clan, t, priority=priority))
+
+
+# template -> LRUCache of content version -> serialized embed payload
+embed_render_cache = {}
+EMBED_RENDER_CACHE_SIZE = int(os.getenv("EMBED_RENDER_CACHE_SIZE", 256))
+
+
+def render_cached(template, version, build):
+    """Return the payload of `build()` for this template and content version.
+
+    The embed is only built on a miss. The returned dict is shared, so copy it
+    before changing anything.
+    """
+    cache = embed_render_cache.get(template)
+    if cache is None:
+        cache = embed_render_cache[template] = LRUCache(EMBED_RENDER_CACHE_SIZE)
+    payload = cache.get(version)
+    if payload is None:
+        payload = build().to_dict()
+        cache.put(version, payload)
+    return payload
 
 
 async def create_clan_embed(clan):
-    embed = Embed(title=f"**{clan.name} | {clan.tag}**", color=(embed_colour))
-    embed.set_thumbnail(url=clan.badge.medium)
-    embed.add_field(name="Level", value=clan.level, inline=True)
-    embed.add_field(name="Clan Description",
-                    value=clan.description, inline=False)
-    embed.add_field(
-        name="Clan Link", value=f"[Press here](https://link.clashofclans.com/en?action=OpenClanProfile&tag={clan.tag})")
-    embed.add_field(
-        name="Members", value=f"{clan.member_count}/50", inline=False)
-    embed.add_field(name="Trophies", value=clan.points, inline=False)
-    embed.add_field(name="War Wins", value=clan.war_wins, inline=False)
-    embed.add_field(name="War Win Streak",
-                    value=clan.war_win_streak, inline=False)
-    embed.add_field(name="Type", value=clan.type, inline=False)
-    embed.add_field(name="Required Trophies",
-                    value=clan.required_trophies, inline=False)
-    embed.set_footer(text=clan.tag, icon_url=clan.badge.medium)
+    version = (clan.tag, clan.name, clan.badge.medium, clan.level, clan.description,
+               clan.member_count, clan.points, clan.war_wins, clan.war_win_streak,
+               clan.type, clan.required_trophies, embed_colour)
+
+    def build():
+        embed = Embed(title=f"**{clan.name} | {clan.tag}**", color=(embed_colour))
+        embed.set_thumbnail(url=clan.badge.medium)
+        embed.add_field(name="Level", value=clan.level, inline=True)
+        embed.add_field(name="Clan Description",
+                        value=clan.description, inline=False)
+        embed.add_field(
+            name="Clan Link", value=f"[Press here](https://link.clashofclans.com/en?action=OpenClanProfile&tag={clan.tag})")
+        embed.add_field(
+            name="Members", value=f"{clan.member_count}/50", inline=False)
+        embed.add_field(name="Trophies", value=clan.points, inline=False)
+        embed.add_field(name="War Wins", value=clan.war_wins, inline=False)
+        embed.add_field(name="War Win Streak",
+                        value=clan.war_win_streak, inline=False)
+        embed.add_field(name="Type", value=clan.type, inline=False)
+        embed.add_field(name="Required Trophies",
+                        value=clan.required_trophies, inline=False)
+        embed.set_footer(text=clan.tag, icon_url=clan.badge.medium)
+        return embed
+
+    return render_cached("clan", version, build)
+
+
+TREND_FIELDS = {
+    "points": "Trophies",
+    "war_wins": "War Wins",
+    "war_win_streak": "War Win Streak",
+    "member_count": "Members",
+}
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+SPARK_WIDTH = 24
+
+
+def sparkline(values, width=SPARK_WIDTH):
+    if len(values) > width:
+        # Keep the last value of each of `width` equal slices
+        values = [values[(i + 1) * len(values) // width - 1] for i in range(width)]
+    low = min(values)
+    span = max(values) - low or 1
+    return "".join(SPARK_CHARS[(value - low) * (len(SPARK_CHARS) - 1) // span] for value in values)
+
+
+def create_clan_trends_embed(clan_tag, clan_name, days):
+    """History of a clan from the snapshot store; never calls the API."""
+    now = time.time()
+    timestamps, series = snapshot_store.read(clan_tag, now - days * 86400, now, tuple(TREND_FIELDS))
+    embed = Embed(title=f"**{clan_name} | {clan_tag} Trends**", color=embed_colour)
+    if not timestamps:
+        embed.description = f"No snapshots from the last {days} day(s) yet."
+        return embed
+    embed.description = f"Since <t:{timestamps[0]}:f>, {len(timestamps)} snapshot(s)"
+    for field, label in TREND_FIELDS.items():
+        values = series[field]
+        embed.add_field(
+            name=label,
+            value=f"{values[0]} → {values[-1]} ({values[-1] - values[0]:+d}) | "
+                  f"low {min(values)}, high {max(values)}\n`{sparkline(values)}`",
+            inline=False)
+    embed.set_footer(text=f"Last snapshot taken {datetime.datetime.fromtimestamp(timestamps[-1], utc):%Y-%m-%d %H:%M} UTC")
     return embed
 
 
 async def create_player_embed(ctx, player):
     player_embed = Embed(title=f"Profile: {player.name}", color=0x00ff00)
-    # Fetch the list of emojis for the guild
-    guild_emojis = await get_guild_emojis(ctx.guild_id)
     unranked_emoji_id = 1144673082397704222
     unranked_icon_url = f"https://cdn.discordapp.com/emojis/{unranked_emoji_id}.png"
     player_embed.add_field(name="Name", value=player.name, inline=True)
@@ -191,38 +482,22 @@ async def create_player_embed(ctx, player):
     player_embed.add_field(name="Level", value=player.exp_level, inline=True)
     if player.league and player.league.name and player.league.icon.url:
         league_emoji_name = player.league.name.replace(" ", "_").lower()
-        existing_league_emoji = next(
-            (e for e in guild_emojis if e['name'] == league_emoji_name), None)
-        if not existing_league_emoji:
-            try:
-                league_emoji = await create_custom_emoji_via_api(ctx.guild_id, league_emoji_name, player.league.icon.url)
-            except Exception as e:
-                print(f"Failed to create league emoji: {e}")
-            trophies_with_league = f"{player.trophies} <:{league_emoji_name}:{league_emoji['id']}>"
-        else:
-            trophies_with_league = f"{player.trophies} <:{league_emoji_name}:{existing_league_emoji['id']}>"
+        league_icon_url = player.league.icon.url
     else:
         league_emoji_name = "unranked"
-        existing_league_emoji = next(
-            (e for e in guild_emojis if e['name'] == league_emoji_name), None)
-        if not existing_league_emoji:
-            try:
-                league_emoji = await create_custom_emoji_via_api(ctx.guild_id, "unranked", unranked_icon_url)
-            except Exception as e:
-                print(f"Failed to create 'unranked' emoji: {e}")
-            trophies_with_league = f"{player.trophies} <:{league_emoji_name}:{league_emoji['id']}>"
-        else:
-            trophies_with_league = f"{player.trophies} <:{league_emoji_name}:{existing_league_emoji['id']}>"
+        league_icon_url = unranked_icon_url
+    try:
+        league_emoji = await ensure_guild_emoji(ctx.guild_id, league_emoji_name, league_icon_url)
+        trophies_with_league = f"{player.trophies} <:{league_emoji_name}:{league_emoji['id']}>"
+    except Exception as e:
+        logger.warning("Failed to create '%s' emoji: %s", league_emoji_name, e,
+                       extra={"handler": "create_player_embed", "guild": ctx.guild_id})
+        trophies_with_league = f"{player.trophies}"
     player_embed.add_field(
         name="Trophies", value=trophies_with_league, inline=True)
     if player.clan:
         emoji_name = player.clan.name
-        existing_emoji = next(
-            (e for e in guild_emojis if e['name'] == emoji_name), None)
-        if existing_emoji:
-            clan_badge_emoji = existing_emoji
-        else:
-            clan_badge_emoji = await create_custom_emoji_via_api(ctx.guild_id, emoji_name, player.clan.badge.medium)
+        clan_badge_emoji = await ensure_guild_emoji(ctx.guild_id, emoji_name, player.clan.badge.medium)
         clan_name_with_emoji = f" {player.clan.name}<:{emoji_name}:{clan_badge_emoji['id']}>"
         player_embed.add_field(
             name="Clan", value=clan_name_with_emoji, inline=True)
@@ -240,150 +515,264 @@ async def create_player_embed(ctx, player):
     return player_embed
 
 
-async def create_clan_leaderboard_embed():
-    clan_data = load_clan_data()
-    sorted_clans = sorted(clan_data.items(), key=lambda x: x[1].get(
-        'activity_score', 0), reverse=True)
+LEADERBOARD_PAGE_SIZE = 10
+
+
+async def create_clan_leaderboard_embed(page=0):
+    rank_clans()
+    page_count = activity_leaderboard.page_count(LEADERBOARD_PAGE_SIZE)
+    page = min(max(page, 0), page_count - 1)
     embed = Embed(title="Clan Activity Leaderboard", color=embed_colour)
 
-    for i, (clan_tag, clan_info) in enumerate(sorted_clans):
-        clan_name = f"Clan {i+1}"
-        activity_score = clan_info.get('activity_score', 0)
+    for rank, clan_tag, activity_score in activity_leaderboard.page(page, LEADERBOARD_PAGE_SIZE):
+        clan_name = f"Clan {rank}"
         embed.add_field(
             name=clan_name, value=f"Tag: {clan_tag}\nActivity Score: {activity_score}", inline=False)
+    embed.set_footer(text=f"Page {page + 1}/{page_count}")
 
-    return embed
+    previous_button = Button(
+        style=ButtonStyle.SECONDARY, label="Previous",
+        custom_id=f"leaderboard_prev:{page}", disabled=page == 0)
+    next_button = Button(
+        style=ButtonStyle.SECONDARY, label="Next",
+        custom_id=f"leaderboard_next:{page}", disabled=page >= page_count - 1)
+    return embed, [ActionRow(previous_button, next_button)]
 
 
 def create_ticket_embed(member_id: int):
-    embed = Embed(title="**Divide by Zero™ Clan Interview**",
-                  description="<a:yellowpointright:1147157048484704326> 1. Click the button `Start Application` to start.\n"
-                              "<a:yellowpointright:1147157048484704326> 2. You will do a short interview that takes only **2-3 minutes.**\n"
-                              "<a:yellowpointright:1147157048484704326> 3. The bot will guide you step by step.\n"
-                              "<a:yellowpointright:1147157048484704326> 4. Our staffs are also available for help.",
-                  color=9180869)
-    embed.set_footer(text="Press \"Human Support\" if further supports are needed.",
-                     icon_url="https://cdn.discordapp.com/attachments/1012759819687571476/1108073866640760922/BOT.png")
-    embed.set_image(
-        url="https://cdn.discordapp.com/attachments/1030039134963777556/1095783760747839539/Untitled-2.png")
-    return embed
+    def build():
+        embed = Embed(title="**Divide by Zero™ Clan Interview**",
+                      description="<a:yellowpointright:1147157048484704326> 1. Click the button `Start Application` to start.\n"
+                                  "<a:yellowpointright:1147157048484704326> 2. You will do a short interview that takes only **2-3 minutes.**\n"
+                                  "<a:yellowpointright:1147157048484704326> 3. The bot will guide you step by step.\n"
+                                  "<a:yellowpointright:1147157048484704326> 4. Our staffs are also available for help.",
+                      color=9180869)
+        embed.set_footer(text="Press \"Human Support\" if further supports are needed.",
+                         icon_url="https://cdn.discordapp.com/attachments/1012759819687571476/1108073866640760922/BOT.png")
+        embed.set_image(
+            url="https://cdn.discordapp.com/attachments/1030039134963777556/1095783760747839539/Untitled-2.png")
+        return embed
+
+    return render_cached("ticket", (), build)
 
 
 def create_start_application_embed():
-    embed = Embed(title="**With how many account do you want to apply?**",
-                  description="- Choose the number of accounts you will be applying with using the select menu.",
-                  color=9180869)
-    embed.set_footer(text="Feel free to ask for help for any confusions.",
-                     icon_url="https://cdn.discordapp.com/attachments/1012759819687571476/1108073866640760922/BOT.png")
-    return embed
+    def build():
+        embed = Embed(title="**With how many account do you want to apply?**",
+                      description="- Choose the number of accounts you will be applying with using the select menu.",
+                      color=9180869)
+        embed.set_footer(text="Feel free to ask for help for any confusions.",
+                         icon_url="https://cdn.discordapp.com/attachments/1012759819687571476/1108073866640760922/BOT.png")
+        return embed
+
+    return render_cached("start_application", (), build)
 
 
 def welcome_embed(member_id, member_display_name, member_avatar_url):
+    def build():
+        embed = Embed(
+            title="**Welcome to Divide by Zero™**",
+            description=f"<a:pandawave:853168924434235402> Hey <@{member_id}>! We offer a diverse array of high-quality clans...",
+            color=9180869
+        )
+        embed.set_author(name=member_display_name, icon_url=member_avatar_url)
+        embed.set_footer(
+            text="Join Time", icon_url="https://cdn.discordapp.com/attachments/1012759819687571476/1108073866640760922/BOT.png")
+        embed.set_image(
+            url="https://cdn.discordapp.com/attachments/881073424884199435/1129845191071776819/DIVIDE_BY_ZERO_1.png")
+        return embed
+
+    return render_cached("welcome", (member_id, member_display_name, str(member_avatar_url)), build)
+
+
+# ------------------- Ticket Handling -------------------
+# Channel id -> ticket, loaded once; see tickets.py for the steps
+ticket_store = TicketStore(storage).load()
+PLAYER_TAG_PATTERN = re.compile(r'^#([0-9A-Za-z]{8})$')
+TICKET_FOOTER_ICON = "https://cdn.discordapp.com/attachments/1012759819687571476/1108073866640760922/BOT.png"
+
+
+def ordinal(number):
+    if 10 <= number % 100 <= 20:
+        return f"{number}th"
+    suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(number % 10, 'th')
+    return f"{number}{suffix}"
+
+
+def ticket_message_url(channel_id, ticket):
+    return f"https://discord.com/channels/{ticket['guild_id']}/{channel_id}/{ticket['original_message_id']}"
+
+
+def create_tag_prompt_embed(channel_id, ticket):
+    account = ordinal(ticket["account_index"] + 1)
     embed = Embed(
-        title="**Welcome to Divide by Zero™**",
-        description=f"<a:pandawave:853168924434235402> Hey <@{member_id}>! We offer a diverse array of high-quality clans...",
+        title=f"**Can you kindly provide the tag of your `{account}` account?**",
+        description=f"- Post the tag of your Clash of Clans account in the chat.\n- Example answer: `#LCCYJVRUY` (can be copied from your profile)\n- Go to this [message]({ticket_message_url(channel_id, ticket)}) and click **\"Human Support\"** button for help.",
         color=9180869
     )
-    embed.set_author(name=member_display_name, icon_url=member_avatar_url)
-    embed.set_footer(
-        text="Join Time", icon_url="https://cdn.discordapp.com/attachments/1012759819687571476/1108073866640760922/BOT.png")
-    embed.set_image(
-        url="https://cdn.discordapp.com/attachments/881073424884199435/1129845191071776819/DIVIDE_BY_ZERO_1.png")
+    embed.set_footer(text="Feel free to ask for help for any confusions.",
+                     icon_url=TICKET_FOOTER_ICON)
     return embed
 
 
-# ------------------- Ticket Handling -------------------
-original_message_ids = {}
-
-
-async def wait_for_message(bot, author_id, channel_id, timeout=60):
-    for _ in range(timeout):
-        def check(m):
-            return m.author.id == author_id and m.channel.id == channel_id
+def create_screenshot_prompt_embed(channel_id, ticket):
+    account = ordinal(ticket["account_index"] + 1)
+    embed = Embed(
+        title=f"**Can you kindly send a screenshot of the base of your `{account}` account?**",
+        description=f"- Please upload the screenshot as an attachment or send it as image URL.\n- This section is optional, you can **skip** this.\n- Go to this [message]({ticket_message_url(channel_id, ticket)}) and click **\"Human Support\"** button for help.",
+        color=9180869
+    )
+    embed.set_footer(text="Feel free to ask for help for any confusions.",
+                     icon_url=TICKET_FOOTER_ICON)
+    return embed
 
-        try:
-            message = await bot.wait_for('message', timeout=1, check=check)
-            return message
-        except asyncio.TimeoutError:
-            continue
 
-    return None
+async def advance_ticket(message, channel_id, ticket):
+    """Move a ticket one step forward with the applicant's latest message."""
+    channel = message.channel
+    content = (message.content or "").strip()
+
+    if ticket["step"] == STEP_AWAITING_TAG:
+        # Check if the message content is a valid Clash of Clans player tag
+        if not PLAYER_TAG_PATTERN.match(content):
+            await channel.send("Invalid Clash of Clans player tag. Please try again.")
+            return
+        ticket["tags"].append(content.upper())
+        ticket["step"] = STEP_AWAITING_SCREENSHOT
+        ticket_store.save(channel_id, ticket)
+        await channel.send(embed=create_screenshot_prompt_embed(channel_id, ticket))
+
+    elif ticket["step"] == STEP_AWAITING_SCREENSHOT:
+        if message.attachments:
+            screenshot = message.attachments[0].url
+        elif content.startswith(("http://", "https://")):
+            screenshot = content
+        elif content.lower() == "skip":
+            screenshot = None
+        else:
+            await channel.send("Please upload a screenshot, send an image URL or type `skip`.")
+            return
+        ticket["screenshots"].append(screenshot)
+        ticket["account_index"] += 1
+        if ticket["account_index"] < ticket["account_count"]:
+            ticket["step"] = STEP_AWAITING_TAG
+            ticket_store.save(channel_id, ticket)
+            await channel.send(embed=create_tag_prompt_embed(channel_id, ticket))
+        else:
+            ticket["step"] = STEP_COMPLETED
+            ticket_store.save(channel_id, ticket)
+            tags = ", ".join(f"`{tag}`" for tag in ticket["tags"])
+            await channel.send(f"<:success:1147171540962648237> Thanks <@{ticket['applicant_id']}>, your application ({tags}) is complete. Our staff will review it shortly.")
 
 
 async def change_ticket_name_to_clan(ctx, clan_tag):
     channel = ctx.channel
     if channel.name.startswith("TBD|"):
-        clan_name = clan_data.get(clan_tag, {}).get("name", "Unknown")
+        clan_info = clan_data.get(clan_tag)
+        clan_name = clan_info.name if clan_info else "Unknown"
         await channel.edit(name=f"{clan_name}|{ctx.author.name}")
 
 
-def save_ticket_data(data):
-    with open('tickets_data.json', 'w') as f:
-        json.dump(data, f, indent=4)
+# ------------------- Bot Events -------------------
 
 
-# ------------------- Bot Events -------------------
+async def connect_coc_client():
+    """Log in to the CoC API, with fixed tokens instead of keys if COC_API_TOKENS is set."""
+    # coc.py's own FIFO throttle gets headroom: coc_scheduler does the rate limiting,
+    # so requests never queue inside coc.py where priorities don't apply
+    client = coc.Client(key_names="keys for my windows pc", key_count=COC_KEY_COUNT,
+                        throttle_limit=COC_KEY_RATE * 2, base_url=COC_API_BASE)
+    if COC_API_TOKENS:
+        await client.login_with_tokens(*COC_API_TOKENS)
+    else:
+        await client.login(Email, Password)
+    return client
 
 
 @bot.event()
+@metrics.timed("listener")
 async def on_ready():
     global coc_client
     load_embed_colour()
-    global clan_data
-    clan_data = load_clan_data()
-    print(f"Logged in as {bot.user}")
+    await discord_http.start()
+    global metrics_server
+    if metrics_server is None and METRICS_PORT:
+        metrics_server = await start_metrics_server(metrics, METRICS_HOST, METRICS_PORT)
+    logger.info("Logged in as %s", bot.user)
     if not coc_client:
-        coc_client = coc.Client(
-            key_names="keys for my windows pc", key_count=5)
-        await coc_client.login(Email, Password)
-        print("Successfully connected to the coc API!")
-    asyncio.get_event_loop().create_task(update_message_counters())
+        coc_client = await connect_coc_client()
+        logger.info("Successfully connected to the coc API!")
+    # Ready fires again after a reconnect; backfills must not run twice at once
+    global refresh_task
+    if refresh_task is None:
+        refresh_task = asyncio.get_event_loop().create_task(update_message_counters())
+    global snapshot_poller
+    if snapshot_poller is None and SNAPSHOT_INTERVAL:
+        snapshot_poller = asyncio.get_event_loop().create_task(poll_clan_snapshots())
 
 
 @bot.event()
+@metrics.timed("listener")
 async def on_message(message):
     if message.author.bot:
         return
 
-    for tag, data in clan_data.items():
-        if message.channel.id == data["default_channel"]:
-            data["messages"] += 1  # Increment the message count
-            save_clan_data(clan_data)  # Save the updated data
-            break
+    clan_tag = clan_channel_index.get(message.channel.id)
+    if clan_tag is None:
+        return
+    clan_data[clan_tag].record_message()
+    save_clan_data(clan_data, clan_tag)  # Save the updated data
 
 # ------------------- Bot Commands -------------------
+LOOKUP_CONCURRENCY = int(os.getenv("LOOKUP_CONCURRENCY", 4))
+
+
+async def retry_with_backoff(func, *args, retries=3, base_delay=0.5, max_delay=8.0):
+    """Await func(*args), retrying GatewayError with exponential backoff and full jitter."""
+    for attempt in range(retries):
+        try:
+            return await func(*args)
+        except GatewayError:
+            if attempt == retries - 1:
+                raise
+            await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
 
 
 @slash_command("player_lookup", description="Provides a detailed overview of the player")
 @slash_option("discord_user", "The Discord user to lookup", opt_type=OptionType.USER, required=True)
 @slash_option("hidden", "Should the response be hidden?", opt_type=OptionType.STRING, required=True, choices=[{"name": "Yes", "value": "yes"}, {"name": "No", "value": "no"}])
+@metrics.timed("command")
 async def player_lookup(ctx, discord_user, hidden):
     plhide = hidden.lower() == "yes"
     await ctx.defer(ephemeral=plhide)
     user_id = str(discord_user.id)
-    if user_id in player_tags:
-        for tag in player_tags[user_id]:
-            retries = 3  # Number of retries
-            while retries:
-                try:
-                    player = await coc_client.get_player(tag)
+    if user_id in player_links:
+        semaphore = asyncio.Semaphore(LOOKUP_CONCURRENCY)
+
+        async def lookup(tag):
+            try:
+                async with semaphore:
+                    player = await retry_with_backoff(get_player, tag)
                     embed = await create_player_embed(ctx, player)
-                    player_profile_url = f"https://link.clashofclans.com/en?action=OpenPlayerProfile&tag={tag}"
-                    link_button = Button(
-                        style=ButtonStyle.LINK, label=f"Open {player.name} Profile", url=player_profile_url)
-                    action_row = ActionRow(link_button)
-                    await ctx.send(embed=embed, components=[action_row], ephemeral=plhide)
-                    break  # Break the loop if successful
-                except GatewayError:
-                    retries -= 1
-                    if retries == 0:
-                        await ctx.send(f"Failed to fetch data for {tag} after multiple attempts.", ephemeral=plhide)
-                        return
-                    await asyncio.sleep(1)  # Wait for 1 second before retrying
-                except Exception as e:
-                    traceback.print_exc()  # This will print the full traceback
-                    await ctx.send(f"An error occurred: {e}", ephemeral=plhide)
-                    break  # Break the loop if an exception other than GatewayError occurs
+                return tag, player, embed, None
+            except Exception as e:
+                return tag, None, None, e
+
+        # Send each profile as soon as it is ready instead of one after another
+        for next_result in asyncio.as_completed([lookup(tag) for tag in player_links.tags(user_id)]):
+            tag, player, embed, error = await next_result
+            if isinstance(error, GatewayError):
+                await ctx.send(f"Failed to fetch data for {tag} after multiple attempts.", ephemeral=plhide)
+            elif error is not None:
+                logger.error("Player lookup for %s failed", tag, exc_info=error,
+                             extra={"handler": "player_lookup", "guild": ctx.guild_id})
+                await ctx.send(f"An error occurred: {error}", ephemeral=plhide)
+            else:
+                player_profile_url = f"https://link.clashofclans.com/en?action=OpenPlayerProfile&tag={tag}"
+                link_button = Button(
+                    style=ButtonStyle.LINK, label=f"Open {player.name} Profile", url=player_profile_url)
+                action_row = ActionRow(link_button)
+                await ctx.send(embed=embed, components=[action_row], ephemeral=plhide)
     else:
         await ctx.send(f"{discord_user.mention} has no linked Clash of Clans accounts.", ephemeral=True)
 
@@ -392,17 +781,29 @@ async def player_lookup(ctx, discord_user, hidden):
 @slash_option("discord_user", "The Discord user to link", opt_type=OptionType.USER, required=True)
 @slash_option("player_tag", "The Clash of Clans ingame tag", opt_type=OptionType.STRING, required=True)
 @slash_option("hidden", "Should the response be hidden?", opt_type=OptionType.STRING, required=True, choices=[{"name": "Yes", "value": "yes"}, {"name": "No", "value": "no"}])
+@metrics.timed("command")
 async def player_link(ctx, discord_user, player_tag, hidden):
     linkhide = hidden.lower() == "yes"
     user_id = str(discord_user.id)
-    if user_id not in player_tags:
-        player_tags[user_id] = []
-    if player_tag not in player_tags[user_id]:
-        player_tags[user_id].append(player_tag)
-        save_tags_to_file(player_tags)
+    owner = player_links.owner(player_tag)
+    if owner is None:
+        player_links.add(user_id, player_tag)
         await ctx.send(f"Successfully linked {discord_user.mention} to the tag {player_tag}!", ephemeral=linkhide)
-    else:
+    elif owner == user_id:
         await ctx.send(f"{discord_user.mention} is already linked to the tag {player_tag}.", ephemeral=True)
+    else:
+        await ctx.send(f"The tag {player_tag} is already linked to <@{owner}>.", ephemeral=True)
+
+
+@slash_command("player_unlink", description="Unlink a Clash of Clans tag from a Discord user")
+@slash_option("discord_user", "The Discord user to unlink", opt_type=OptionType.USER, required=True)
+@slash_option("player_tag", "The Clash of Clans ingame tag", opt_type=OptionType.STRING, required=True)
+@metrics.timed("command")
+async def player_unlink(ctx, discord_user, player_tag):
+    if player_links.remove(discord_user.id, player_tag):
+        await ctx.send(f"Unlinked {discord_user.mention} from the tag {player_tag}.", ephemeral=True)
+    else:
+        await ctx.send(f"{discord_user.mention} is not linked to the tag {player_tag}.", ephemeral=True)
 
 
 @slash_command("clan", description="Manage your clan")
@@ -417,28 +818,23 @@ async def clan_command(ctx):
 @slash_option("clan_leader_role", "The clan leader role", opt_type=OptionType.ROLE, required=True)
 @slash_option("clan_role", "The clan role", opt_type=OptionType.ROLE, required=True)
 @slash_option("requirement", "The requirement for the clan", opt_type=OptionType.STRING, required=True)
+@metrics.timed("command")
 async def add_clan(ctx, tag, name, default_channel, clan_leader_role, clan_role, requirement):
-    print(ctx.kwargs)
+    logger.info("Adding clan %s: %s", tag, ctx.kwargs,
+                extra={"handler": "add_clan", "guild": ctx.guild_id, "clan_tag": tag})
     if tag not in clan_data:
-        default_channel_id = default_channel.id  # Convert to ID
-        clan_leader_role_id = clan_leader_role.id  # Convert to ID
-        clan_role_id = clan_role.id  # Convert to ID
-
-        clan_data[tag] = {
-            "name": name,
-            "default_channel": default_channel_id,
-            "leader_role": clan_leader_role_id,
-            "clan_role": clan_role_id,
-            "requirement": requirement,
-            "lastdaymessages": 0,
-            "lastweekmessages": 0,
-            "last2weeksmessages": 0,
-            "lastmonthsmessages": 0,
-            "activity_score": 0
-        }
-        save_clan_data(clan_data)
+        default_channel_id = int(default_channel.id)
+        clan_data[tag] = ClanRecord(
+            name=name,
+            default_channel=default_channel_id,
+            leader_role=int(clan_leader_role.id),
+            clan_role=int(clan_role.id),
+            requirement=requirement)
+        clan_channel_index[default_channel_id] = tag
+        activity_leaderboard.update(tag, 0)
+        save_clan_data(clan_data, tag)
         global clan_tags_choices
-        clan_tags_choices = load_clan_tags()
+        clan_tags_choices = [{"name": tag, "value": tag} for tag in clan_data]
         await ctx.send(f"Clan {tag} has been added.")
     else:
         await ctx.send(f"Clan {tag} is already added.")
@@ -446,10 +842,16 @@ async def add_clan(ctx, tag, name, default_channel, clan_leader_role, clan_role,
 
 @clan_command.subcommand("remove", sub_cmd_description="Removes a clan")
 @slash_option("tag", "The tag of the clan", opt_type=OptionType.STRING, required=True, choices=clan_tags_choices)
+@metrics.timed("command")
 async def remove_clan(ctx, tag):
     if tag in clan_data:
-        del clan_data[tag]
-        save_clan_data(clan_data)
+        clan_info = clan_data.pop(tag)
+        channel_id = clan_info.default_channel
+        if channel_id is not None and clan_channel_index.get(channel_id) == tag:
+            del clan_channel_index[channel_id]
+        activity_leaderboard.remove(tag)
+        activity_scorer.forget(tag)
+        save_clan_data(clan_data, tag)
         await ctx.send(f"Clan {tag} has been removed.")
     else:
         await ctx.send(f"Clan {tag} does not exist.")
@@ -457,9 +859,10 @@ async def remove_clan(ctx, tag):
 
 @clan_command.subcommand("select", sub_cmd_description="Select a clan")
 @slash_option("tag", "The tag of the clan", opt_type=OptionType.STRING, required=True, choices=clan_tags_choices)
+@metrics.timed("command")
 async def select_clan(ctx, tag):
     await ctx.defer()
-    clan = await coc_client.get_clan(tag)
+    clan = await get_clan(tag)
     if clan is None:
         await ctx.send("Clan not found.")
         return
@@ -474,26 +877,115 @@ async def select_clan(ctx, tag):
     await ctx.send(embed=embed, components=[action_row])
 
 
+ROSTER_CONCURRENCY = int(os.getenv("ROSTER_CONCURRENCY", 10))
+ROSTER_PAGE_SIZE = 20  # Members per embed
+
+
+@clan_command.subcommand("roster", sub_cmd_description="Audit every member of a clan")
+@slash_option("tag", "The tag of the clan", opt_type=OptionType.STRING, required=True, choices=clan_tags_choices)
+@metrics.timed("command")
+async def clan_roster(ctx, tag):
+    await ctx.defer()
+    clan = await get_clan(tag)
+    if clan is None:
+        await ctx.send("Clan not found.")
+        return
+
+    semaphore = asyncio.Semaphore(ROSTER_CONCURRENCY)
+
+    async def fetch_member(member):
+        async with semaphore:
+            try:
+                return await retry_with_backoff(get_player, member.tag, BULK)
+            except Exception as e:
+                logger.warning("Failed to fetch roster member %s: %s", member.tag, e,
+                               extra={"handler": "clan_roster", "clan_tag": tag})
+                return None
+
+    members = list(clan.members)
+    players = await asyncio.gather(*(fetch_member(member) for member in members))
+
+    lines = []
+    for member, player in zip(members, players):
+        user_id = player_links.owner(member.tag)
+        linked = f"<@{user_id}>" if user_id else "Not linked"
+        if player is None:
+            lines.append(f"**{member.name}** `{member.tag}` | Failed to fetch | {linked}")
+        else:
+            lines.append(f"**{player.name}** `{player.tag}` | TH{player.town_hall} | "
+                         f"Trophies: {player.trophies} | War Stars: {player.war_stars} | {linked}")
+
+    pages = [lines[i:i + ROSTER_PAGE_SIZE] for i in range(0, len(lines), ROSTER_PAGE_SIZE)] or [[]]
+    embeds = []
+    for page_number, page in enumerate(pages, start=1):
+        embed = Embed(title=f"**{clan.name} | {clan.tag} Roster**",
+                      description="\n".join(page) or "This clan has no members.", color=embed_colour)
+        embed.set_footer(text=f"Page {page_number}/{len(pages)} | {len(members)} members",
+                         icon_url=clan.badge.medium)
+        embeds.append(embed)
+    # Discord allows at most 10 embeds per message
+    for i in range(0, len(embeds), 10):
+        await ctx.send(embeds=embeds[i:i + 10])
+
+
 @clan_command.subcommand("activity", sub_cmd_description="Check clan activity score")
 @slash_option("tag", "The tag of the clan", opt_type=OptionType.STRING, required=True, choices=clan_tags_choices)
+@metrics.timed("command")
 async def clan_activity(ctx, tag):
     clan_info = clan_data.get(tag, None)
     if clan_info:
-        activity_score = await calculate_activity_score(clan_info)
+        activity_score = calculate_activity_score(tag)
         await ctx.send(f"The activity score for clan {tag} is {activity_score:.2f}")
     else:
         await ctx.send(f"Clan {tag} does not exist.")
 
 
+@clan_command.subcommand("trends", sub_cmd_description="Show a clan's trophy, war and member history")
+@slash_option("tag", "The tag of the clan", opt_type=OptionType.STRING, required=True, choices=clan_tags_choices)
+@slash_option("days", "How many days to look back (default 7)", opt_type=OptionType.INTEGER, required=False, min_value=1, max_value=365)
+@metrics.timed("command")
+async def clan_trends(ctx, tag, days=7):
+    clan_info = clan_data.get(tag)
+    if clan_info is None:
+        await ctx.send(f"Clan {tag} does not exist.")
+        return
+    await ctx.send(embed=create_clan_trends_embed(coc.utils.correct_tag(tag), clan_info.name, days))
+
+
 @clan_command.subcommand("leaderboard", sub_cmd_description="Displays the clan activity leaderboard")
+@metrics.timed("command")
 async def clan_leaderboard(ctx):
     await ctx.defer()
-    embed = await create_clan_leaderboard_embed()
+    embed, components = await create_clan_leaderboard_embed()
+    await ctx.send(embed=embed, components=components, ephemeral=True)
+
+
+@component_callback(re.compile(r"^leaderboard_(prev|next):\d+$"))
+@metrics.timed("component")
+async def leaderboard_page_callback(ctx: ComponentContext):
+    direction, page = ctx.custom_id.split(":")
+    page = int(page) + (1 if direction == "leaderboard_next" else -1)
+    embed, components = await create_clan_leaderboard_embed(page)
+    await ctx.edit_origin(embed=embed, components=components)
+
+
+@slash_command("metrics", description="Show handler latency and error metrics", default_member_permissions=Permissions.ADMINISTRATOR)
+@metrics.timed("command")
+async def metrics_command(ctx):
+    embed = Embed(title="Handler Metrics (slowest p99 first)", color=embed_colour)
+    for kind, name, count, errors, p50, p99 in metrics.summary(limit=20):
+        embed.add_field(
+            name=f"{kind}: {name}",
+            value=f"Calls: {count} | Errors: {errors}\np50: {p50 * 1000:.0f} ms | p99: {p99 * 1000:.0f} ms",
+            inline=False)
+    if not embed.fields:
+        embed.description = "No handlers have run yet."
     await ctx.send(embed=embed, ephemeral=True)
 
 
 @slash_command("embed-colour", description="Change the colour of the embed")
 @slash_option("colour", "Choose a colour", opt_type=OptionType.STRING, required=True, choices=[{"name": colour, "value": colour} for colour in COLOURS.keys()])
+@metrics.timed("command")
 async def change_embed_colour(ctx, colour):
     selected_colour = COLOURS[colour]
     save_embed_colour(selected_colour)  # Save the colour
@@ -508,6 +1000,7 @@ async def ticket_command(ctx):
 
 
 @ticket_command.subcommand("open", sub_cmd_description="Opens a new ticket")
+@metrics.timed("command")
 async def open_ticket(ctx, reason=None):
     guild = ctx.guild
     channel_name = f'𝐓𝐁𝐃｜{ctx.author.username}'
@@ -533,27 +1026,32 @@ async def open_ticket(ctx, reason=None):
         embed=embed,
         components=[action_row1]
     )
-    original_message_ids[channel.id] = message.id
+    ticket_store.save(channel.id, new_ticket(guild.id, ctx.author.id, message.id))
 
 
 @ticket_command.subcommand("close", sub_cmd_description="Closes the ticket")
+@metrics.timed("command")
 async def close_ticket(ctx):
     channel = ctx.channel
     if channel.name.startswith("𝐓𝐁𝐃｜") or channel.name.startswith("ticket|"):
+        ticket_store.delete(channel.id)
         await channel.delete()
 
 
 @ticket_command.subcommand("change", sub_cmd_description="Changes the ticket name to the clan name")
 @slash_option("clan_tag", "The clan tag", opt_type=OptionType.STRING, required=True, choices=clan_tags_choices)
+@metrics.timed("command")
 async def change_ticket_name_to_clan(ctx, clan_tag):
     channel = ctx.channel
     if channel.name.startswith("𝐓𝐁𝐃｜"):
-        clan_name = clan_data.get(clan_tag, {}).get("name", "Unknown")
+        clan_info = clan_data.get(clan_tag)
+        clan_name = clan_info.name if clan_info else "Unknown"
         await channel.edit(name=f"{clan_name}|{ctx.author.username}")
 
 
 @ticket_command.subcommand("add", sub_cmd_description="Adds a user to the ticket")
 @slash_option("user", "The user to add", opt_type=OptionType.USER, required=True)
+@metrics.timed("command")
 async def add_user(ctx, user):
     channel = ctx.channel
     if channel.name.startswith("𝐓𝐁𝐃｜") or channel.name.startswith("ticket|"):
@@ -562,6 +1060,7 @@ async def add_user(ctx, user):
 
 @ticket_command.subcommand("remove", sub_cmd_description="Removes a user from the ticket")
 @slash_option("user", "The user to remove", opt_type=OptionType.USER, required=True)
+@metrics.timed("command")
 async def remove_user(ctx, user):
     channel = ctx.channel
     if channel.name.startswith("TBD|") or channel.name.startswith("ticket|"):
@@ -572,126 +1071,317 @@ async def remove_user(ctx, user):
 
 
 @listen()
+@metrics.timed("listener")
 async def on_message_create(event):
     message_channel = event.message._channel_id
+    ticket = ticket_store.get(message_channel)
+    if (ticket is not None and int(event.message.author.id) == ticket["applicant_id"]
+            and ticket["step"] in (STEP_AWAITING_TAG, STEP_AWAITING_SCREENSHOT)):
+        await advance_ticket(event.message, message_channel, ticket)
+    clan_tag = clan_channel_index.get(message_channel)
+    if clan_tag is None:
+        return
 
-    print(f"Message received in channel {message_channel}")
-    for clan_tag, clan_info in clan_data.items():
-        print(f"Checking clan {clan_tag}")
-
-        if "default_channel" in clan_info and clan_info["default_channel"] == message_channel:
-
-            print(f"Message was in the default channel for clan {clan_tag}")
-            if "messages" not in clan_info:
-                clan_info["messages"] = 0
-            clan_info["messages"] += 1
-            save_clan_data(clan_data)
+    clan_info = clan_data[clan_tag]
+    clan_info.record_message()
+    message_id = int(event.message.id)
+    live_since_message.setdefault(clan_tag, message_id)
+    newest_live_message[clan_tag] = max(message_id, newest_live_message.get(clan_tag, 0))
+    if clan_tag in caught_up_clans:
+        clan_info.counted_through = max(message_id, clan_info.counted_through or 0)
+    save_clan_data(clan_data, clan_tag)
 
-            print(
-                f"Updated message count for clan {clan_tag}: {clan_info['messages']}")
-            break
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Updated message count to %d", clan_info.messages,
+                     extra={"handler": "on_message_create", "guild": event.message._guild_id,
+                            "channel": message_channel, "clan_tag": clan_tag, "sample": LOG_SAMPLE_RATE})
 
 
 @listen()
+@metrics.timed("listener")
 async def on_message_delete(event):
     message_channel = event.message._channel_id
+    clan_tag = clan_channel_index.get(message_channel)
+    if clan_tag is None:
+        return
 
-    print(f"Message deleted in channel {message_channel}")
-    for clan_tag, clan_info in clan_data.items():
-        print(f"Checking clan {clan_tag}")
+    clan_info = clan_data[clan_tag]
+    clan_info.forget_message(snowflake_time(event.message.id))
+    save_clan_data(clan_data, clan_tag)
 
-        if "default_channel" in clan_info and clan_info["default_channel"] == message_channel:
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Updated message count to %d", clan_info.messages,
+                     extra={"handler": "on_message_delete", "guild": event.message._guild_id,
+                            "channel": message_channel, "clan_tag": clan_tag, "sample": LOG_SAMPLE_RATE})
 
-            print(f"Message was in the default channel for clan {clan_tag}")
-            if "messages" in clan_info and clan_info["messages"] > 0:
-                clan_info["messages"] -= 1
-            save_clan_data(clan_data)
 
-            print(
-                f"Updated message count for clan {clan_tag}: {clan_info['messages']}")
-            break
+HISTORY_PAGE_SIZE = 100  # Discord's maximum per request
+
+
+@listen()
+@metrics.timed("listener")
+async def on_guild_emojis_update(event):
+    guild_emoji_cache.pop(int(event.guild_id), None)
+
 
+@metrics.timed("discord_rest")
+async def fetch_messages_from_channel(channel_id, time_limit=None, after=None):
+    """Page through a channel's history.
 
-async def fetch_messages_from_channel(channel_id, time_limit=None):
+    With `after`, walks forward from that message id up to the newest message.
+    Otherwise walks backwards from the newest message until `time_limit`.
+    Each page may take up to REFRESH_TIMEOUT seconds.
+    """
     channel = bot.get_channel(channel_id)
     if channel is None:
         return []
     messages = []
-    async for message in channel.history(limit=100):
-        if time_limit is None or message.created_at >= time_limit:
-            messages.append(message)
-
+    if after is not None:
+        cursor = int(after)
+        while True:
+            page = await asyncio.wait_for(
+                channel.fetch_messages(limit=HISTORY_PAGE_SIZE, after=cursor), REFRESH_TIMEOUT)
+            for message in page:
+                if time_limit is None or message.created_at >= time_limit:
+                    messages.append(message)
+            if len(page) < HISTORY_PAGE_SIZE:
+                break
+            cursor = max(int(message.id) for message in page)
+        return messages
+
+    kwargs = {}
+    while True:
+        page = await asyncio.wait_for(
+            channel.fetch_messages(limit=HISTORY_PAGE_SIZE, **kwargs), REFRESH_TIMEOUT)
+        for message in page:
+            if time_limit is None or message.created_at >= time_limit:
+                messages.append(message)
+        if len(page) < HISTORY_PAGE_SIZE:
+            break
+        oldest = min(page, key=lambda message: int(message.id))
+        if time_limit is not None and oldest.created_at < time_limit:
+            break
+        kwargs["before"] = oldest.id
     return messages
 
 
+REFRESH_INTERVAL = int(os.getenv("REFRESH_INTERVAL", 600))
+REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY", 8))
+REFRESH_TIMEOUT = float(os.getenv("REFRESH_TIMEOUT", 60))
+refresh_task = None
+refresh_stats = {
+    "cycles": 0,
+    "last_duration": 0.0,
+    "last_failures": 0,
+    "last_timeouts": 0,
+    "total_failures": 0,
+}
+
+
+# First message id on_message_create counted into each clan's current ring.
+# Anything from there on is already counted, so backfills stop short of it.
+live_since_message = {}
+newest_live_message = {}
+# Clans backfilled this session. Until then there may be a gap between
+# counted_through and the live messages, so those must not move it.
+caught_up_clans = set()
+
+
+async def backfill_clan_history(clan_tag, clan_info):
+    time_limit = datetime.datetime.utcnow().replace(
+        tzinfo=utc) - datetime.timedelta(days=30)
+    checkpoint = clan_info.counted_through
+    counter = clan_info.activity
+    full_backfill = (not counter.seeded or checkpoint is None
+                     or snowflake_time(checkpoint) < time_limit.timestamp())
+
+    if full_backfill:
+        # Page back through the whole 30 day window into a new ring. It is
+        # installed first so live messages arriving meanwhile land in it too.
+        previous, previous_live_since = counter, live_since_message.pop(clan_tag, None)
+        counter = ActivityCounter()
+        clan_info.activity = counter
+        try:
+            messages = await fetch_messages_from_channel(clan_info.default_channel, time_limit)
+        except BaseException:
+            # Keep the old ring, plus whatever arrived live during the fetch
+            previous.merge(counter)
+            clan_info.activity = previous
+            if previous_live_since is not None:
+                live_since_message[clan_tag] = previous_live_since
+            raise
+    else:
+        live_since = live_since_message.get(clan_tag)
+        if live_since is not None and checkpoint >= live_since:
+            caught_up_clans.add(clan_tag)
+            return  # Listening since before the checkpoint, nothing was missed
+        # Only messages posted while we weren't listening
+        messages = await fetch_messages_from_channel(
+            clan_info.default_channel, time_limit, after=checkpoint)
+
+    # Read again: the first live message may have arrived during the fetch
+    live_since = live_since_message.get(clan_tag)
+    # Live messages counted into this ring are covered by the checkpoint too
+    newest = max(checkpoint or 0, newest_live_message.get(clan_tag, 0) if live_since else 0)
+    for message in messages:
+        message_id = int(message.id)
+        newest = max(newest, message_id)
+        if live_since is None or message_id < live_since:
+            counter.record(message.created_at.timestamp())
+    counter.seeded = True
+    if newest:
+        clan_info.counted_through = max(newest, clan_info.counted_through or 0)
+    caught_up_clans.add(clan_tag)
+
+
+async def notify_clan_activity(clan_tag, clan_info):
+    activity_score = clan_info.activity_score
+    clan_role_id = clan_info.clan_role
+    if clan_role_id:
+        if activity_score < 2:
+            await bot.get_channel(clan_info.default_channel).send(f"<@&{clan_role_id}> improve clan activity, currently you're at {activity_score:.2f}")
+        elif activity_score == 10:
+            await bot.get_channel(clan_info.default_channel).send(f"<@&{clan_role_id}> Well done, you reached a {activity_score:.2f} rating!")
+
+
+@metrics.timed("task")
+async def refresh_all_clans():
+    semaphore = asyncio.Semaphore(REFRESH_CONCURRENCY)
+
+    async def run(step, timeout, clan_tag, clan_info):
+        async with semaphore:
+            await asyncio.wait_for(step(clan_tag, clan_info), timeout)
+
+    async def run_all(step, timeout=REFRESH_TIMEOUT):
+        results = await asyncio.gather(
+            *(run(step, timeout, clan_tag, clan_info) for clan_tag, clan_info in clans), return_exceptions=True)
+        failures = timeouts = 0
+        for (clan_tag, _), result in zip(clans, results):
+            if isinstance(result, asyncio.TimeoutError):
+                timeouts += 1
+                logger.warning("Refreshing clan timed out after %ss", REFRESH_TIMEOUT,
+                               extra={"handler": step.__name__, "clan_tag": clan_tag})
+            elif isinstance(result, Exception):
+                failures += 1
+                logger.error("Refreshing clan failed: %r", result, exc_info=result,
+                             extra={"handler": step.__name__, "clan_tag": clan_tag})
+        return failures, timeouts
+
+    started = time.perf_counter()
+    clans = list(clan_data.items())
+    # No overall limit here: each history page has its own timeout, and a full
+    # 30 day backfill of a busy channel has to be able to finish once
+    failures, timeouts = await run_all(backfill_clan_history, timeout=None)
+
+    # Score every clan in one batch, then send the role pings
+    rank_clans()
+    notify_failures, notify_timeouts = await run_all(notify_clan_activity)
+    failures += notify_failures
+    timeouts += notify_timeouts
+    save_clan_data(clan_data)
+
+    refresh_stats["cycles"] += 1
+    refresh_stats["last_duration"] = time.perf_counter() - started
+    refresh_stats["last_failures"] = failures
+    refresh_stats["last_timeouts"] = timeouts
+    refresh_stats["total_failures"] += failures + timeouts
+    logger.info("Refreshed %d clan(s) in %.2fs (%d failed, %d timed out)",
+                len(clans), refresh_stats["last_duration"], failures, timeouts,
+                extra={"handler": "update_message_counters"})
+
+
 async def update_message_counters():
     while True:
-        for clan_tag, clan_info in clan_data.items():
-            counters = {
-                "lastdaymessages": 0,
-                "lastweekmessages": 0,
-                "last2weeksmessages": 0,
-                "lastmonthsmessages": 0,
-            }
-            time_limit = datetime.datetime.utcnow().replace(
-                tzinfo=utc) - datetime.timedelta(days=30)
-            messages = await fetch_messages_from_channel(clan_info["default_channel"], time_limit)
-
-            for message in messages:
-                timestamp = message.created_at
-                delta = datetime.datetime.utcnow().replace(tzinfo=utc) - timestamp
-
-                if delta < datetime.timedelta(days=1):
-                    counters["lastdaymessages"] += 1
-                if delta < datetime.timedelta(days=7):
-                    counters["lastweekmessages"] += 1
-                if delta < datetime.timedelta(days=14):
-                    counters["last2weeksmessages"] += 1
-                if delta < datetime.timedelta(days=30):
-                    counters["lastmonthsmessages"] += 1
-            clan_data[clan_tag].update(counters)
-
-            activity_score = await calculate_activity_score(clan_info)
-            clan_info["activity_score"] = activity_score
-            clan_role_id = clan_info.get("clan_role", None)
-            if clan_role_id:
-                if activity_score < 2:
-                    await bot.get_channel(clan_info["default_channel"]).send(f"<@&{clan_role_id}> improve clan activity, currently you're at {activity_score:.2f}")
-                elif activity_score == 10:
-                    await bot.get_channel(clan_info["default_channel"]).send(f"<@&{clan_role_id}> Well done, you reached a {activity_score:.2f} rating!")
-            save_clan_data(clan_data)
-        await asyncio.sleep(600)
-
-
-async def calculate_activity_score(clan_info):
-    last_day = clan_info.get("lastdaymessages", 0)
-    last_week = clan_info.get("lastweekmessages", 0)
-    last_2_weeks = clan_info.get("last2weeksmessages", 0)
-    last_month = clan_info.get("lastmonthsmessages", 0)
-
-    raw_score = (0.4 * last_day) + (0.3 * last_week) + \
-        (0.2 * last_2_weeks) + (0.1 * last_month)
-    normalized_score = min(10, raw_score / 100 * 10)
-    return normalized_score
-
-
-original_message_urls = {}
+        try:
+            await refresh_all_clans()
+        except Exception:
+            logger.exception("Clan refresh cycle failed",
+                             extra={"handler": "update_message_counters"})
+        await asyncio.sleep(REFRESH_INTERVAL)
+
+
+def calculate_activity_score(clan_tag):
+    activity_score = activity_scorer.score(clan_tag, clan_data[clan_tag].activity)
+    set_activity_score(clan_tag, activity_score)
+    return activity_score
+
+
+# ------------------- Clan Snapshots -------------------
+# Keep this under CLAN_CACHE_TTL + CLAN_CACHE_STALE_TTL so /clan select is
+# always answered from the last snapshot. 0 disables the poller.
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", 900))
+snapshot_store = SnapshotStore(os.getenv("SNAPSHOT_DIR", "clan_snapshots"))
+snapshot_poller = None
+snapshot_stats = {
+    "cycles": 0,
+    "last_duration": 0.0,
+    "last_failures": 0,
+    "snapshots": 0,
+}
+
+
+async def snapshot_clan(clan_tag):
+    tag = coc.utils.correct_tag(clan_tag)
+    # Straight to the API rather than get_clan, which could hand back a stale copy
+    clan = await coc_scheduler.submit(("clan", tag), fetch_clan, tag, priority=BACKGROUND)
+    snapshot_store.append(tag, time.time(), {
+        "points": clan.points,
+        "war_wins": clan.war_wins,
+        "war_win_streak": clan.war_win_streak,
+        "member_count": clan.member_count,
+        "level": clan.level,
+    })
+    # Prewarm /clan select: the clan itself and its rendered embed
+    clan_cache.put(tag, clan)
+    await create_clan_embed(clan)
+
+
+@metrics.timed("task")
+async def snapshot_all_clans():
+    started = time.perf_counter()
+    clan_tags = list(clan_data)
+    results = await asyncio.gather(*(snapshot_clan(clan_tag) for clan_tag in clan_tags), return_exceptions=True)
+    failures = 0
+    for clan_tag, result in zip(clan_tags, results):
+        if isinstance(result, Exception):
+            failures += 1
+            logger.warning("Snapshotting clan failed: %r", result,
+                           extra={"handler": "snapshot_clan", "clan_tag": clan_tag})
+
+    snapshot_stats["cycles"] += 1
+    snapshot_stats["last_duration"] = time.perf_counter() - started
+    snapshot_stats["last_failures"] = failures
+    snapshot_stats["snapshots"] += len(clan_tags) - failures
+    logger.info("Snapshotted %d clan(s) in %.2fs (%d failed)",
+                len(clan_tags), snapshot_stats["last_duration"], failures,
+                extra={"handler": "poll_clan_snapshots"})
+
+
+async def poll_clan_snapshots():
+    while True:
+        try:
+            await snapshot_all_clans()
+        except Exception:
+            logger.exception("Clan snapshot cycle failed",
+                             extra={"handler": "poll_clan_snapshots"})
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
 
 
 @bot.listen()
+@metrics.timed("listener")
 async def on_component(event: Component):
     ctx = event.ctx
 
     match ctx.custom_id:
         case "start_application":
-            original_message_id = original_message_ids.get(ctx.channel.id)
-            if original_message_id:
-                original_message_url = f"https://discord.com/channels/{ctx.guild_id}/{ctx.channel_id}/{original_message_id}"
-                # Store the URL
-                original_message_urls[ctx.channel.id] = original_message_url
+            ticket = ticket_store.get(ctx.channel_id)
+            if ticket and ticket["step"] in (STEP_OPENED, STEP_CHOOSING_ACCOUNTS):
+                original_message_url = ticket_message_url(ctx.channel_id, ticket)
+                ticket["step"] = STEP_CHOOSING_ACCOUNTS
+                ticket_store.save(ctx.channel_id, ticket)
 
-                embed = create_start_application_embed()
-                embed.description += f"\n- Go to this [message]({original_message_url}) and click **\"Human Support\"** button for help."
+                embed = dict(create_start_application_embed())
+                embed["description"] += f"\n- Go to this [message]({original_message_url}) and click **\"Human Support\"** button for help."
 
                 # Create the selection menu
                 selection_menu = StringSelectMenu(
@@ -713,6 +1403,7 @@ async def on_component(event: Component):
 
 
 @slash_command(name='button', description='Testing a button.')
+@metrics.timed("command")
 async def button(ctx: SlashContext):
     components = Button(
         style=ButtonStyle.GREEN,
@@ -723,10 +1414,13 @@ async def button(ctx: SlashContext):
 
 
 @component_callback("account_selection")
+@metrics.timed("component")
 async def menu_callback(ctx: ComponentContext):
     selected_option = ctx.values[0]  # Get the selected option
-    original_message_url = original_message_urls.get(
-        ctx.channel.id)  # Retrieve the stored URL
+    ticket = ticket_store.get(ctx.channel_id)
+    if ticket is None or ticket["step"] != STEP_CHOOSING_ACCOUNTS:
+        await ctx.send("This application is no longer waiting for an account count.", ephemeral=True)
+        return
 
     # Create a disabled selection menu
     disabled_selection_menu = StringSelectMenu(
@@ -742,40 +1436,18 @@ async def menu_callback(ctx: ComponentContext):
     # Edit the original message to disable the selection menu
     await ctx.edit_origin(components=[disabled_action_row])
 
-    # Create the new embed
-    embed = Embed(
-        title=f"**Can you kindly provide the tag of your `{selected_option}st` account?**",
-        description=f"- Post the tag of your Clash of Clans account in the chat.\n- Example answer: `#LCCYJVRUY` (can be copied from your profile)\n- Go to this [message]({original_message_url}) and click **\"Human Support\"** button for help.",
-        color=9180869
-    )
-    embed.set_footer(text="Feel free to ask for help for any confusions.",
-                     icon_url="https://cdn.discordapp.com/attachments/1012759819687571476/1108073866640760922/BOT.png")
-    # Wait for the next message from the user in the channel
-
-    # Wait for the next message from the user in the channel
-    message = await wait_for_message(bot, ctx.author.id, ctx.channel.id)
-    if message is None:
-        await ctx.channel.send("You took too long to respond. Please try again.")
-        return
-
-    # Check if the message content is a valid Clash of Clans player tag
-    if not re.match(r'^#([0-9A-Za-z]{8})$', message.content):
-        await ctx.channel.send("Invalid Clash of Clans player tag. Please try again.")
-        return
-
-    # Create the new embed for the screenshot request
-    embed = Embed(
-        title=f"**Can you kindly send a screenshot of the base of your `{selected_option}st` account?**",
-        description=f"- Please upload the screenshot as an attachment or send it as image URL.\n- This section is optional, you can **skip** this.\n- Go to this [message]({original_message_url}) and click **\"Human Support\"** button for help.",
-        color=9180869
-    )
-    embed.set_footer(text="Feel free to ask for help for any confusions.",
-                     icon_url="https://cdn.discordapp.com/attachments/1012759819687571476/1108073866640760922/BOT.png")
-
-    await ctx.channel.send(embed=embed)
+    ticket["account_count"] = int(selected_option)
+    ticket["account_index"] = 0
+    ticket["tags"] = []
+    ticket["screenshots"] = []
+    ticket["step"] = STEP_AWAITING_TAG
+    ticket_store.save(ctx.channel_id, ticket)
+    # The applicant's next message in the channel is handled by on_message_create
+    await ctx.channel.send(embed=create_tag_prompt_embed(ctx.channel_id, ticket))
 
 
 @bot.listen()
+@metrics.timed("listener")
 async def on_component(event: Component):
     ctx = event.ctx
     embed = Embed(
@@ -788,6 +1460,7 @@ async def on_component(event: Component):
 
 
 @slash_command("testgreet", description="Manually trigger the welcome message for testing")
+@metrics.timed("command")
 async def testgreet_command(ctx):
     await send_welcome_message(ctx.author)
 
@@ -802,7 +1475,63 @@ async def send_welcome_message(member):
 
 
 @bot.listen("on_member_join")
+@metrics.timed("listener")
 async def on_member_join(member):
     await send_welcome_message(member)
+# ------------------- Metrics -------------------
+
+
+def collect_cache_stats():
+    values = {}
+    for cache_name, cache in (("player", player_cache), ("clan", clan_cache)):
+        for result, value in cache.stats().items():
+            values[(("cache", cache_name), ("stat", result))] = value
+    return values
+
+
+metrics.register_gauge(
+    "coc_cache", "CoC response cache hits, stale hits, misses and size.", collect_cache_stats)
+metrics.register_gauge(
+    "coc_queue_depth", "CoC requests waiting in the scheduler, by priority class.",
+    lambda: {(("priority", priority),): depth for priority, depth in coc_scheduler.depths().items()})
+metrics.register_gauge(
+    "coc_scheduler", "CoC scheduler requests, coalesced/promoted/throttled calls and longest wait, by priority class.",
+    lambda: {(("priority", priority), ("stat", stat)): value
+             for priority, stats in coc_scheduler.stats.items() for stat, value in stats.items()})
+metrics.register_gauge(
+    "refresh", "Clan refresh loop cycle statistics.",
+    lambda: {(("stat", stat),): value for stat, value in refresh_stats.items()})
+metrics.register_gauge(
+    "snapshots", "Clan snapshot poller cycle statistics.",
+    lambda: {(("stat", stat),): value for stat, value in snapshot_stats.items()})
+metrics.register_gauge(
+    "clan_data_writer", "Write-behind clan data flushes.",
+    lambda: {(("stat", "flushes"),): clan_data_writer.flushes,
+             (("stat", "merged_writes"),): clan_data_writer.merged_writes,
+             (("stat", "pending"),): clan_data_writer.pending,
+             (("stat", "last_flush_seconds"),): clan_data_writer.last_flush_duration})
+
+
 # ------------------- Main -------------------
-bot.start(BOT_TOKEN)
+
+
+async def main():
+    try:
+        await bot.astart(BOT_TOKEN)
+    finally:
+        if snapshot_poller is not None:
+            snapshot_poller.cancel()
+        if refresh_task is not None:
+            refresh_task.cancel()
+        await coc_scheduler.close()
+        await clan_data_writer.flush()
+        await storage.drain()
+        await discord_http.close()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        storage.close()
+        snapshot_store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
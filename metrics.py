@@ -0,0 +1,151 @@
+# ------------------- Imports -------------------
+import functools
+import logging
+import math
+import time
+from bisect import bisect_left
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside the bucket that holds it."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if BUCKETS[i] != math.inf else lower * 2 or 1.0
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKETS[-2]
+
+
+# ------------------- Registry -------------------
+
+
+class MetricsRegistry:
+    """Latency histograms and error counters keyed by (kind, name).
+
+    kind is what was timed, e.g. "command", "component", "listener", "task",
+    "coc" or "discord_rest"; name is the handler or call.
+    """
+
+    def __init__(self, prefix="bot"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.errors = {}
+        self.gauges = {}  # metric name -> (help text, function returning {label dict tuple: value})
+
+    def observe(self, kind, name, seconds, error=False):
+        key = (kind, name)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+        if error:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def timed(self, kind, name=None):
+        """Decorator recording the latency and failures of an async function."""
+        def decorator(func):
+            metric_name = name or func.__name__
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                return await self.call(kind, metric_name, func, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    async def call(self, kind, name, func, *args, **kwargs):
+        """Await func(*args, **kwargs) and record it, for calls we do not own."""
+        started = time.perf_counter()
+        error = False
+        try:
+            return await func(*args, **kwargs)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(kind, name, time.perf_counter() - started, error)
+
+    def register_gauge(self, name, help_text, collect):
+        """`collect()` returns {((label, value), ...): number}."""
+        self.gauges[name] = (help_text, collect)
+
+    def summary(self, limit=10):
+        """Rows of (kind, name, count, errors, p50, p99), slowest p99 first."""
+        rows = [(kind, name, histogram.count, self.errors.get((kind, name), 0),
+                 histogram.quantile(0.5), histogram.quantile(0.99))
+                for (kind, name), histogram in self.histograms.items()]
+        rows.sort(key=lambda row: row[5], reverse=True)
+        return rows[:limit]
+
+    def render_prometheus(self):
+        latency = f"{self.prefix}_latency_seconds"
+        errors = f"{self.prefix}_errors_total"
+        lines = [f"# HELP {latency} Latency of handlers and outbound calls.",
+                 f"# TYPE {latency} histogram"]
+        for (kind, name), histogram in sorted(self.histograms.items()):
+            labels = f'kind="{kind}",name="{name}"'
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, histogram.counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f'{latency}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{latency}_sum{{{labels}}} {histogram.total}")
+            lines.append(f"{latency}_count{{{labels}}} {histogram.count}")
+        lines += [f"# HELP {errors} Handler and outbound call failures.",
+                  f"# TYPE {errors} counter"]
+        for (kind, name), count in sorted(self.errors.items()):
+            lines.append(f'{errors}{{kind="{kind}",name="{name}"}} {count}')
+        for gauge, (help_text, collect) in sorted(self.gauges.items()):
+            metric = f"{self.prefix}_{gauge}"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            try:
+                values = collect()
+            except Exception:
+                logger.exception("Collecting gauge %s failed", gauge)
+                continue
+            for labels, value in values.items():
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# ------------------- HTTP Endpoint -------------------
+
+
+async def start_metrics_server(registry, host="127.0.0.1", port=9100):
+    """Serve registry.render_prometheus() on http://host:port/metrics."""
+    async def handle(request):
+        return web.Response(body=registry.render_prometheus().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,81 @@
+# ------------------- Imports -------------------
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------- Player Links -------------------
+
+
+class PlayerLinkStore:
+    """Discord user <-> Clash of Clans tag links, indexed both ways.
+
+    Every tag belongs to at most one user. Lookups, adds and removes are O(1)
+    and each change is persisted as a single row through `storage`.
+
+    Older rows may link a tag to a second user or spell it unnormalized. Those
+    are deduplicated in memory only; storage is never rewritten on load.
+    """
+
+    def __init__(self, storage, normalize=str):
+        self.storage = storage
+        self.normalize = normalize
+        self.tags_by_user = {}  # user id -> {tag: None}, a dict keeps link order
+        self.owner_by_tag = {}  # tag -> user id
+        self.stored_as = {}  # (user id, tag) -> stored spellings, when not just `tag`
+
+    def load(self):
+        self.tags_by_user.clear()
+        self.owner_by_tag.clear()
+        self.stored_as.clear()
+        for user_id, tags in self.storage.load_player_links().items():
+            for tag in tags:
+                normalized = self.normalize(tag)
+                owner = self.owner_by_tag.get(normalized)
+                if owner is None:
+                    self._index(user_id, normalized)
+                elif owner != user_id:
+                    # From before tags were unique: the first link wins
+                    logger.warning("Ignoring link of %s to user %s, already linked to user %s",
+                                   tag, user_id, owner)
+                    continue
+                if normalized != tag or (user_id, normalized) in self.stored_as:
+                    self.stored_as.setdefault((user_id, normalized), [normalized]).append(tag)
+        return self
+
+    def _index(self, user_id, tag):
+        self.tags_by_user.setdefault(user_id, {})[tag] = None
+        self.owner_by_tag[tag] = user_id
+
+    def __contains__(self, user_id):
+        return str(user_id) in self.tags_by_user
+
+    def tags(self, user_id):
+        return list(self.tags_by_user.get(str(user_id), ()))
+
+    def owner(self, tag):
+        return self.owner_by_tag.get(self.normalize(tag))
+
+    def add(self, user_id, tag):
+        """Link `tag` to `user_id`. Returns the tag's owner (which is `user_id` on success)."""
+        user_id, tag = str(user_id), self.normalize(tag)
+        owner = self.owner_by_tag.get(tag)
+        if owner is not None:
+            return owner
+        self._index(user_id, tag)
+        self.storage.submit(self.storage.add_player_link, user_id, tag)
+        return user_id
+
+    def remove(self, user_id, tag):
+        user_id, tag = str(user_id), self.normalize(tag)
+        if self.owner_by_tag.get(tag) != user_id:
+            return False
+        del self.owner_by_tag[tag]
+        tags = self.tags_by_user[user_id]
+        del tags[tag]
+        if not tags:
+            del self.tags_by_user[user_id]
+        for stored in self.stored_as.pop((user_id, tag), (tag,)):
+            self.storage.submit(self.storage.remove_player_link, user_id, stored)
+        return True
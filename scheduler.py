@@ -0,0 +1,219 @@
+# ------------------- Imports -------------------
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first
+INTERACTIVE = 0  # A user is waiting on this one lookup
+BULK = 1  # Fan-out behind a command, e.g. every member of a roster
+BACKGROUND = 2  # Nobody is waiting: refreshes, polling, prewarming
+PRIORITY_NAMES = ("interactive", "bulk", "background")
+
+THROTTLED_COOLDOWN = 1.0  # Seconds a key sits out after a 429
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        self.tokens = 0
+        self.updated = now
+        self.blocked_until = now + seconds
+
+
+class _Request:
+    __slots__ = ("key", "priority", "func", "args", "future", "enqueued_at", "queued", "attempts", "key_index")
+
+    def __init__(self, key, priority, func, args, future):
+        self.key = key
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.queued = False
+        self.attempts = 0
+        self.key_index = None
+
+
+# ------------------- Scheduler -------------------
+
+
+class CocScheduler:
+    """Priority queue in front of coc_client.
+
+    Requests are dispatched most urgent class first (FIFO within a class),
+    each one spending a token from the bucket of the API key coc.py will use
+    next; coc.py rotates its keys round-robin, so the buckets follow the same
+    rotation. A 429 empties that key's bucket for THROTTLED_COOLDOWN seconds
+    and puts the request back in the queue.
+
+    Identical requests (same key) share one call while it is queued or
+    running; a more urgent caller joining a queued request promotes it.
+    """
+
+    def __init__(self, key_count=5, rate=30.0, burst=None, concurrency=20, max_retries=3, metrics=None):
+        self.buckets = [TokenBucket(rate, burst or rate) for _ in range(key_count)]
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.running = 0
+        self._next_key = 0
+        self._queue = []  # (priority, sequence, request), stale entries skipped on pop
+        self._sequence = itertools.count()
+        self._in_flight = {}  # request key -> _Request
+        self._depths = [0] * len(PRIORITY_NAMES)
+        self._wakeup = None
+        self._dispatcher = None
+        self._tasks = set()
+        self.stats = {name: {"requests": 0, "coalesced": 0, "promoted": 0, "dispatched": 0,
+                             "throttled": 0, "failed": 0, "wait_max": 0.0}
+                      for name in PRIORITY_NAMES}
+
+    def depths(self):
+        return dict(zip(PRIORITY_NAMES, self._depths))
+
+    async def submit(self, key, func, *args, priority=INTERACTIVE):
+        """Queue `await func(*args)` and return its result.
+
+        Concurrent submits with the same `key` (e.g. ("player", tag)) share
+        the call. Cancelling one caller does not cancel it for the others.
+        """
+        stats = self.stats[PRIORITY_NAMES[priority]]
+        request = self._in_flight.get(key)
+        if request is not None:
+            stats["coalesced"] += 1
+            self.promote(key, priority)
+            return await asyncio.shield(request.future)
+
+        stats["requests"] += 1
+        request = _Request(key, priority, func, args, asyncio.get_running_loop().create_future())
+        self._in_flight[key] = request
+        request.future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        self._push(request)
+        return await asyncio.shield(request.future)
+
+    def promote(self, key, priority):
+        """Move a queued request up to `priority`, if it is waiting in a lower class."""
+        request = self._in_flight.get(key)
+        if request is None or not request.queued or request.priority <= priority:
+            return
+        self.stats[PRIORITY_NAMES[priority]]["promoted"] += 1
+        self._depths[request.priority] -= 1
+        request.priority = priority
+        self._depths[priority] += 1
+        # The old heap entry is left behind and skipped, see _pop
+        heapq.heappush(self._queue, (priority, next(self._sequence), request))
+        self._wake()
+
+    def _push(self, request):
+        request.queued = True
+        self._depths[request.priority] += 1
+        heapq.heappush(self._queue, (request.priority, next(self._sequence), request))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        self._wake()
+
+    def _pop(self):
+        """Return the most urgent queued request, dropping stale heap entries."""
+        while self._queue:
+            priority, _, request = self._queue[0]
+            if request.queued and request.priority == priority:
+                return request
+            heapq.heappop(self._queue)
+        return None
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            request = self._pop()
+            if request is None or self.running >= self.concurrency:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            bucket = self.buckets[self._next_key]
+            delay = bucket.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue  # Something more urgent may have arrived meanwhile
+
+            heapq.heappop(self._queue)
+            request.queued = False
+            self._depths[request.priority] -= 1
+            bucket.take()
+            request.key_index = self._next_key
+            self._next_key = (self._next_key + 1) % len(self.buckets)
+
+            name = PRIORITY_NAMES[request.priority]
+            wait = now - request.enqueued_at
+            stats = self.stats[name]
+            stats["dispatched"] += 1
+            stats["wait_max"] = max(stats["wait_max"], wait)
+            if self.metrics is not None:
+                self.metrics.observe("coc_queue", name, wait)
+            self.running += 1
+            task = asyncio.ensure_future(self._execute(request))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, request):
+        try:
+            result = await request.func(*request.args)
+        except asyncio.CancelledError:
+            request.future.cancel()
+            raise
+        except Exception as e:
+            if getattr(e, "status", None) == 429 and request.attempts < self.max_retries:
+                # The API disagrees with our bucket: rest that key and try again
+                request.attempts += 1
+                self.stats[PRIORITY_NAMES[request.priority]]["throttled"] += 1
+                self.buckets[request.key_index].block(time.monotonic(), THROTTLED_COOLDOWN)
+                logger.warning("CoC key %d throttled, requeueing %r", request.key_index, request.key)
+                self._push(request)
+            else:
+                self.stats[PRIORITY_NAMES[request.priority]]["failed"] += 1
+                if not request.future.done():
+                    request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            self.running -= 1
+            self._wake()
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
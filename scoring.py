@@ -0,0 +1,91 @@
+# ------------------- Imports -------------------
+from activity import BUCKET_COUNT, WINDOWS, current_hour
+
+try:
+    import numpy as np
+except ImportError:  # Scores are still computed, one clan at a time
+    np = None
+
+
+DEFAULT_WEIGHTS = (0.4, 0.3, 0.2, 0.1)  # Day, week, 2 weeks, month
+MAX_SCORE = 10
+FULL_SCORE_RAW = 100  # Raw (weighted) message count that scores MAX_SCORE
+
+
+# ------------------- Activity Scorer -------------------
+
+
+class ActivityScorer:
+    """Scores every clan's ActivityCounter in one batch.
+
+    mode="windows": weighted sum of the four window counts (see WINDOWS).
+    mode="decay": every hourly bucket weighted by 0.5 ** (age / half_life),
+    scaled so a steady message rate scores the same as in "windows" mode.
+
+    Scores are memoised per clan until its counter changes.
+    """
+
+    def __init__(self, mode="windows", weights=DEFAULT_WEIGHTS, half_life_hours=72.0):
+        if mode not in ("windows", "decay"):
+            raise ValueError(f"Unknown activity score mode: {mode}")
+        if len(weights) != len(WINDOWS):
+            raise ValueError(f"Expected {len(WINDOWS)} window weights, got {len(weights)}")
+        self.mode = mode
+        self.weights = tuple(float(weight) for weight in weights)
+        self.half_life_hours = float(half_life_hours)
+        self._memo = {}  # tag -> (counter, counter version, score)
+
+        # Bucket weight by age in hours, for "decay" mode
+        self._decay = [0.5 ** (age / self.half_life_hours) for age in range(BUCKET_COUNT)]
+        steady_windows = sum(weight * length for weight, length in zip(self.weights, WINDOWS.values()))
+        self._decay_scale = steady_windows / sum(self._decay)
+        self._weights_vector = np.array(self.weights) if np is not None else None
+        self._decay_vector = np.array(self._decay) * self._decay_scale if np is not None else None
+
+    def _normalize(self, raw):
+        return min(MAX_SCORE, raw / FULL_SCORE_RAW * MAX_SCORE)
+
+    def _raw_score(self, counter):
+        if self.mode == "windows":
+            return sum(weight * total for weight, total in zip(self.weights, counter.totals))
+        head = counter.head_hour or 0
+        return self._decay_scale * sum(
+            counter.buckets[(head - age) % BUCKET_COUNT] * weight for age, weight in enumerate(self._decay))
+
+    def _raw_scores(self, counters, head):
+        if np is None:
+            return [self._raw_score(counter) for counter in counters]
+        if self.mode == "windows":
+            totals = np.array([counter.totals for counter in counters], dtype=np.float64)
+            return totals @ self._weights_vector
+        # All counters share `head`, so slot i has the same age in every row
+        buckets = np.frombuffer(b"".join(counter.buckets for counter in counters), dtype=np.uint32)
+        buckets = buckets.reshape(len(counters), BUCKET_COUNT).astype(np.float64)
+        ages = (head - np.arange(BUCKET_COUNT)) % BUCKET_COUNT
+        return buckets @ self._decay_vector[ages]
+
+    def score(self, clan_tag, counter):
+        return self.score_all({clan_tag: counter})[clan_tag]
+
+    def score_all(self, counters):
+        """Score {tag: ActivityCounter}; returns {tag: score from 0 to MAX_SCORE}."""
+        head = current_hour()
+        scores = {}
+        stale = []
+        for tag, counter in counters.items():
+            counter.advance(head)
+            memo = self._memo.get(tag)
+            if memo is not None and memo[0] is counter and memo[1] == counter.version:
+                scores[tag] = memo[2]
+            else:
+                stale.append((tag, counter))
+        if stale:
+            raw_scores = self._raw_scores([counter for _, counter in stale], head)
+            for (tag, counter), raw in zip(stale, raw_scores):
+                score = self._normalize(float(raw))
+                self._memo[tag] = (counter, counter.version, score)
+                scores[tag] = score
+        return scores
+
+    def forget(self, clan_tag):
+        self._memo.pop(clan_tag, None)
@@ -0,0 +1,155 @@
+# ------------------- Imports -------------------
+import logging
+import mmap
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+logger = logging.getLogger(__name__)
+
+# Column -> array typecode. Values are stored native-endian, one per snapshot.
+COLUMNS = {
+    "timestamp": "q",  # Unix seconds
+    "points": "i",
+    "war_wins": "i",
+    "war_win_streak": "i",
+    "member_count": "i",
+    "level": "i",
+}
+METRICS = tuple(column for column in COLUMNS if column != "timestamp")
+
+
+def series_directory(root, tag):
+    """Directory holding one clan's columns, e.g. root/2PP for #2PP."""
+    return os.path.join(root, "".join(c for c in tag if c.isalnum()).upper())
+
+
+# ------------------- Series -------------------
+
+
+class ClanSeries:
+    """One clan's snapshots, one file per column in COLUMNS.
+
+    Every column file holds `rows` fixed-width values in append order, so row
+    i of every column belongs to the same snapshot. Reads memory-map the files
+    and are remapped only after they have grown.
+    """
+
+    __slots__ = ("directory", "rows", "_maps")
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._maps = {}  # column -> (mmap, memoryview cast to its typecode)
+        os.makedirs(directory, exist_ok=True)
+        self.rows = self._repair()
+
+    def _path(self, column):
+        return os.path.join(self.directory, column + ".col")
+
+    def _repair(self):
+        """Cut every column back to the number of complete rows.
+
+        An append interrupted part way leaves some columns one value longer
+        than the others; the snapshot is dropped rather than misaligned.
+        """
+        sizes = {}
+        for column in COLUMNS:
+            try:
+                size = os.path.getsize(self._path(column))
+            except FileNotFoundError:
+                size = 0
+            sizes[column] = size
+        rows = min(size // array(COLUMNS[column]).itemsize for column, size in sizes.items())
+        for column, size in sizes.items():
+            length = rows * array(COLUMNS[column]).itemsize
+            if size != length:
+                logger.warning("Truncating %s from %d to %d bytes", self._path(column), size, length)
+                with open(self._path(column), "ab") as f:
+                    f.truncate(length)
+        return rows
+
+    def append(self, timestamp, values):
+        """Add one snapshot. Timestamps never go backwards, so reads can bisect."""
+        if self.rows:
+            timestamp = max(timestamp, self.column("timestamp", self.rows - 1, self.rows)[0])
+        row = dict(values, timestamp=timestamp)
+        for column, typecode in COLUMNS.items():
+            with open(self._path(column), "ab") as f:
+                f.write(array(typecode, (int(row.get(column) or 0),)).tobytes())
+        self.rows += 1
+
+    def _view(self, column):
+        mapped = self._maps.get(column)
+        if mapped is None or len(mapped[1]) < self.rows:
+            with open(self._path(column), "rb") as f:
+                file_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Views still handed out keep the old map alive until they are released
+            mapped = self._maps[column] = (file_map, memoryview(file_map).cast(COLUMNS[column]))
+        return mapped[1]
+
+    def column(self, column, start, stop):
+        """Values of rows [start, stop) as a list."""
+        if stop <= start:
+            return []
+        with self._view(column)[start:stop] as values:
+            return values.tolist()
+
+    def rows_between(self, start=None, end=None):
+        """Row range [first, stop) of snapshots taken in [start, end]."""
+        if not self.rows:
+            return 0, 0
+        with self._view("timestamp")[:self.rows] as timestamps:
+            first = 0 if start is None else bisect_left(timestamps, start)
+            stop = self.rows if end is None else bisect_right(timestamps, end)
+        return first, stop
+
+    def close(self):
+        for file_map, view in self._maps.values():
+            view.release()
+            file_map.close()
+        self._maps.clear()
+
+
+# ------------------- Store -------------------
+
+
+class SnapshotStore:
+    """Append-only clan history, a ClanSeries per clan under `root`.
+
+    Series are opened on first use and kept open.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._series = {}
+
+    def series(self, tag, create=True):
+        """The series of `tag`, or None if it has none yet and not `create`."""
+        directory = series_directory(self.root, tag)
+        series = self._series.get(directory)
+        if series is None:
+            if not create and not os.path.isdir(directory):
+                return None
+            series = self._series[directory] = ClanSeries(directory)
+        return series
+
+    def append(self, tag, timestamp, values):
+        self.series(tag).append(int(timestamp), values)
+
+    def read(self, tag, start=None, end=None, metrics=METRICS):
+        """Snapshots of `tag` taken between `start` and `end` (unix seconds).
+
+        Returns (timestamps, {metric: values}), oldest first.
+        """
+        series = self.series(tag, create=False)
+        if series is None:
+            return [], {metric: [] for metric in metrics}
+        first, stop = series.rows_between(start, end)
+        return (series.column("timestamp", first, stop),
+                {metric: series.column(metric, first, stop) for metric in metrics})
+
+    def close(self):
+        for series in self._series.values():
+            series.close()
+        self._series.clear()
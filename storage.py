@@ -0,0 +1,213 @@
+# ------------------- Imports -------------------
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clans (
+    tag TEXT PRIMARY KEY,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS player_links (
+    user_id TEXT NOT NULL,
+    player_tag TEXT NOT NULL,
+    PRIMARY KEY (user_id, player_tag)
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    channel_id TEXT PRIMARY KEY,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+logger = logging.getLogger(__name__)
+
+# The JSON files this database replaces
+LEGACY_FILES = {
+    "clans": "clans_data.json",
+    "player_links": "player_tags.json",
+    "tickets": "tickets_data.json",
+    "embed_colour": "embed_colour.json",
+}
+
+
+# ------------------- Storage -------------------
+
+
+class Storage:
+    """SQLite (WAL mode) store for clans, player links, tickets and settings.
+
+    Every write is a single transaction touching only the rows that changed.
+    The methods are blocking; from the event loop use `await storage.run(...)`
+    or `storage.submit(...)`, which execute them in order on one worker thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self._pending = set()
+
+    def connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def submit(self, func, *args):
+        """Queue a write without waiting for it. Runs inline outside the event loop."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return func(*args)
+        future = loop.run_in_executor(self._executor, func, *args)
+        self._pending.add(future)
+        future.add_done_callback(self._write_done)
+
+    def _write_done(self, future):
+        self._pending.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Storage write failed", exc_info=future.exception())
+
+    async def drain(self):
+        """Wait for every write queued with submit()."""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # Clans
+
+    def load_clans(self):
+        return {tag: json.loads(record) for tag, record in self._query("SELECT tag, record FROM clans")}
+
+    def write_clans(self, records, removed=(), replace=False):
+        """Upsert `records` ({tag: record}) and delete `removed` tags.
+
+        With `replace`, every clan not in `records` is deleted as well.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO clans (tag, record) VALUES (?, ?) "
+                "ON CONFLICT(tag) DO UPDATE SET record = excluded.record",
+                [(tag, json.dumps(record)) for tag, record in records.items()])
+            self._conn.executemany(
+                "DELETE FROM clans WHERE tag = ?", [(tag,) for tag in removed])
+            if replace:
+                self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS kept (tag TEXT PRIMARY KEY)")
+                self._conn.execute("DELETE FROM kept")
+                self._conn.executemany("INSERT INTO kept (tag) VALUES (?)", [(tag,) for tag in records])
+                self._conn.execute("DELETE FROM clans WHERE tag NOT IN (SELECT tag FROM kept)")
+
+    # Player links
+
+    def load_player_links(self):
+        links = {}
+        for user_id, player_tag in self._query(
+                "SELECT user_id, player_tag FROM player_links ORDER BY rowid"):
+            links.setdefault(user_id, []).append(player_tag)
+        return links
+
+    def add_player_link(self, user_id, player_tag):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO player_links (user_id, player_tag) VALUES (?, ?)",
+                (str(user_id), player_tag))
+
+    def remove_player_link(self, user_id, player_tag):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM player_links WHERE user_id = ? AND player_tag = ?",
+                (str(user_id), player_tag))
+
+    # Tickets
+
+    def load_tickets(self):
+        return {channel_id: json.loads(record)
+                for channel_id, record in self._query("SELECT channel_id, record FROM tickets")}
+
+    def upsert_ticket(self, channel_id, record):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO tickets (channel_id, record) VALUES (?, ?) "
+                "ON CONFLICT(channel_id) DO UPDATE SET record = excluded.record",
+                (str(channel_id), json.dumps(record)))
+
+    def delete_ticket(self, channel_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tickets WHERE channel_id = ?", (str(channel_id),))
+
+    # Settings
+
+    def get_setting(self, key, default=None):
+        rows = self._query("SELECT value FROM settings WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    def set_setting(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO settings (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, json.dumps(value)))
+
+    # Migration
+
+    def migrate_json_files(self, directory="."):
+        """Import the legacy JSON files once. The files are left in place."""
+        if self.get_setting("json_migrated"):
+            return False
+
+        def read(name):
+            try:
+                with open(os.path.join(directory, LEGACY_FILES[name]), 'r') as f:
+                    return json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return None
+
+        clans = read("clans")
+        links = read("player_links")
+        tickets = read("tickets")
+        colour = read("embed_colour")
+        with self._lock, self._conn:
+            if isinstance(clans, dict):
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO clans (tag, record) VALUES (?, ?)",
+                    [(tag, json.dumps(record)) for tag, record in clans.items()])
+            if isinstance(links, dict):
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO player_links (user_id, player_tag) VALUES (?, ?)",
+                    [(str(user_id), tag) for user_id, tags in links.items() for tag in tags])
+            if isinstance(tickets, dict):
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO tickets (channel_id, record) VALUES (?, ?)",
+                    [(str(channel_id), json.dumps(record)) for channel_id, record in tickets.items()])
+            if colour is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO settings (key, value) VALUES ('embed_colour', ?)",
+                    (json.dumps(colour),))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('json_migrated', 'true')")
+        return True
@@ -0,0 +1,51 @@
+# ------------------- Ticket Steps -------------------
+STEP_OPENED = "opened"  # Waiting for "Start Application"
+STEP_CHOOSING_ACCOUNTS = "choosing_accounts"  # Waiting for the account count menu
+STEP_AWAITING_TAG = "awaiting_tag"  # Waiting for the player tag of the current account
+STEP_AWAITING_SCREENSHOT = "awaiting_screenshot"  # Waiting for a base screenshot (or "skip")
+STEP_COMPLETED = "completed"
+
+
+def new_ticket(guild_id, applicant_id, original_message_id):
+    return {
+        "guild_id": int(guild_id),
+        "applicant_id": int(applicant_id),
+        "original_message_id": int(original_message_id),
+        "step": STEP_OPENED,
+        "account_count": 0,
+        "account_index": 0,
+        "tags": [],
+        "screenshots": [],
+    }
+
+
+# ------------------- Ticket Store -------------------
+
+
+class TicketStore:
+    """Open application tickets keyed by channel id, persisted one row per ticket.
+
+    A ticket is a plain dict (see new_ticket); handlers move it one step
+    forward and call save(), so no coroutine is parked per applicant and
+    tickets carry on where they left off after a restart.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.tickets = {}
+
+    def load(self):
+        self.tickets = {int(channel_id): ticket
+                        for channel_id, ticket in self.storage.load_tickets().items()}
+        return self
+
+    def get(self, channel_id):
+        return self.tickets.get(int(channel_id))
+
+    def save(self, channel_id, ticket):
+        self.tickets[int(channel_id)] = ticket
+        self.storage.submit(self.storage.upsert_ticket, int(channel_id), ticket)
+
+    def delete(self, channel_id):
+        if self.tickets.pop(int(channel_id), None) is not None:
+            self.storage.submit(self.storage.delete_ticket, int(channel_id))